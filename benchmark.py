@@ -0,0 +1,478 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import lookup_creator
+
+# Folder this script (and lookup_creator.py) lives in
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Default location of the benchmark results, one JSON record per line, kept between runs to compare versions
+DEFAULT_RESULTS_PATH = os.path.join(os.path.expanduser("~"), ".cja_tools", "benchmark_results.jsonl")
+
+# File formats the generator can write, and the extension each is written with
+FILE_FORMATS = {"csv": ".csv", "saint2.0": ".tab", "saint2.1": ".tab"}
+
+# Number of columns (including the key column) of each file shape
+FILE_SHAPES = {"narrow": 3, "wide": 40}
+
+# Rows generated and written at a time
+GENERATE_CHUNK_ROWS = 10000
+
+# Words the generated text values are made of; classification values repeat a lot, so they're drawn from a small set
+WORDS = ["spring", "summer", "autumn", "winter", "email", "search", "social", "display", "brand", "promo", "retarget", "launch", "clearance", "loyalty", "video"]
+
+# A result slower than the previous version's by more than this fraction is reported as a regression
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+# Value of one generated cell. Columns cycle through text, integer, decimal and date values so type inference and the
+# conversion of every kind of cell are exercised. Text cells sometimes hold the characters each format has to escape.
+def generate_value(rng, file_format, column_number, row_number):
+    kind = column_number % 4
+    if kind == 1:
+        text = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {row_number % 1000}"
+        if row_number % 50 == 0:
+            if file_format == "csv":
+                return f'"{text}, ""quoted"""'
+            if file_format == "saint2.1":
+                return f'"{text} ""quoted"""'
+        return text
+    if kind == 2:
+        return str(rng.randrange(1000000))
+    if kind == 3:
+        return f"{rng.random()*1000:.2f}"
+    return (date(2020, 1, 1) + timedelta(days=row_number % 2000)).isoformat()
+
+
+# Write a synthetic lookup file of the given format ("csv", "saint2.0" or "saint2.1") with rows data rows and
+# column_count columns, the first being a unique key. The same arguments always write the same file.
+def generate_lookup_file(file_path, file_format, rows, column_count, seed=0):
+    rng = random.Random(seed)
+    delimiter = "," if file_format == "csv" else "\t"
+    headers = ["Key"] + [f"Column {column_number}" for column_number in range(1, column_count)]
+
+    with open(file_path, "w", encoding="utf-8", newline="") as f:
+        if file_format != "csv":
+            version = file_format[len("saint"):]
+            f.write(f"## SC\tSiteCatalyst SAINT Import File\tv:{version}\n")
+            f.write("## SC\t'## SC' indicates a SiteCatalyst pre-process header. Please do not remove this line.\n")
+        f.write(delimiter.join(headers) + "\n")
+
+        for chunk_start in range(0, rows, GENERATE_CHUNK_ROWS):
+            lines = []
+            for row_number in range(chunk_start, min(chunk_start + GENERATE_CHUNK_ROWS, rows)):
+                cells = [f"key{row_number:09d}"]
+                cells.extend(generate_value(rng, file_format, column_number, row_number) for column_number in range(1, column_count))
+                lines.append(delimiter.join(cells))
+            f.write("\n".join(lines) + "\n")
+
+
+# Stand-in for the parts of the Platform API and IMS that lookup_creator.py calls: the schema registry (classes, field
+# groups, schemas), the catalog (datasets, batch status) and batch ingestion (batches, file uploads, completion).
+# Every response is delayed by latency seconds, and throttle_rate of the Platform API calls are answered with a 429.
+# Uploaded files are read and thrown away; only their size is kept.
+class MockPlatformAPI:
+    def __init__(self, latency=0.0, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.registry = {"classes": [], "fieldgroups": [], "schemas": []}
+        self.datasets = {}
+        self.batches = {}
+        self.request_count = 0
+        self.throttled_count = 0
+        self.uploaded_bytes = 0
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                api.handle(self, "GET")
+
+            def do_POST(self):
+                api.handle(self, "POST")
+
+            def do_PUT(self):
+                api.handle(self, "PUT")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def handle(self, request, method):
+        body = read_request_body(request)
+        url = urlparse(request.path)
+        path = url.path
+        query = parse_qs(url.query)
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.request_count += 1
+            throttled = not path.startswith("/ims/") and self.rng.random() < self.throttle_rate
+            if throttled:
+                self.throttled_count += 1
+        if throttled:
+            return send_json(request, 429, {"error_code": "429050", "message": "Too many requests"}, {"Retry-After": "0"})
+
+        with self.lock:
+            status, response = self.route(method, path, query, body)
+        send_json(request, status, response)
+
+    def route(self, method, path, query, body):
+        if path == "/ims/exchange/jwt":
+            return 200, {"access_token": "benchmark-token", "token_type": "bearer", "expires_in": 24*60*60*1000}
+
+        registry_prefix = "/data/foundation/schemaregistry/tenant/"
+        if path.startswith(registry_prefix):
+            resource_type, _, resource_id = path[len(registry_prefix):].partition("/")
+            resources = self.registry.get(resource_type)
+            if resources is None:
+                return 404, {"title": "Not found"}
+            if resource_id:
+                resource_id = unquote(resource_id)
+                for index, resource in enumerate(resources):
+                    if resource["$id"] == resource_id:
+                        if method == "PUT":
+                            resources[index] = dict(json.loads(body), **{"$id": resource_id})
+                        return 200, resources[index]
+                return 404, {"title": "Not found"}
+            if method == "POST":
+                resource = dict(json.loads(body), **{"$id": f"https://ns.adobe.com/benchmark/{resource_type}/{len(resources)}"})
+                resources.append(resource)
+                return 201, resource
+            title = query.get("property", [""])[0].partition("==")[2]
+            return 200, {"results": [resource for resource in resources if resource.get("title") == title]}
+
+        if path == "/data/foundation/catalog/dataSets":
+            if method == "POST":
+                dataset_id = f"dataset{len(self.datasets)}"
+                self.datasets[dataset_id] = json.loads(body)
+                return 201, [f"@/dataSets/{dataset_id}"]
+            name = query.get("name", [None])[0]
+            return 200, {dataset_id: dataset for dataset_id, dataset in self.datasets.items() if name is None or dataset.get("name") == name}
+
+        if path.startswith("/data/foundation/catalog/batches/"):
+            batch_id = path.rsplit("/", 1)[1]
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return 404, {"title": "Not found"}
+            status = "success" if batch["closed"] else "loading"
+            return 200, {batch_id: {"status": status, "metrics": {"inputByteSize": batch["bytes"]}}}
+
+        if path == "/data/foundation/import/batches" and method == "POST":
+            batch_id = f"batch{len(self.batches)}"
+            self.batches[batch_id] = {"files": 0, "bytes": 0, "closed": False}
+            return 201, {"id": batch_id}
+
+        if path.startswith("/data/foundation/import/batches/"):
+            batch_id = path.split("/")[5]
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return 404, {"title": "Not found"}
+            if method == "PUT" and "/files/" in path:
+                batch["files"] += 1
+                batch["bytes"] += len(body)
+                self.uploaded_bytes += len(body)
+                return 200, None
+            if method == "POST" and query.get("action") == ["COMPLETE"]:
+                batch["closed"] = True
+                return 200, None
+
+        return 404, {"title": "Not found"}
+
+
+# Read the body of a request, which the upload of a streamed part sends in chunks
+def read_request_body(request):
+    if request.headers.get("Transfer-Encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            chunk_size = int(request.rfile.readline().split(b";")[0], 16)
+            if chunk_size == 0:
+                request.rfile.readline()
+                break
+            chunks.append(request.rfile.read(chunk_size))
+            request.rfile.readline()
+        return b"".join(chunks)
+    content_length = int(request.headers.get("Content-Length") or 0)
+    return request.rfile.read(content_length) if content_length else b""
+
+
+def send_json(request, status, response, headers=None):
+    data = json.dumps(response).encode() if response is not None else b""
+    request.send_response(status)
+    for header, value in (headers or {}).items():
+        request.send_header(header, value)
+    request.send_header("Content-Type", "application/json")
+    request.send_header("Content-Length", str(len(data)))
+    request.end_headers()
+    request.wfile.write(data)
+
+
+# Write a throwaway private key and credentials file that the mock Platform API accepts, returning the credentials path
+def write_benchmark_credentials(work_folder):
+    # Optional, only needed for the full pipeline benchmark (pyjwt already needs it to sign RS256 tokens)
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key_path = os.path.join(work_folder, "benchmark_private.key")
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(key_path, "wb") as f:
+        f.write(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+    creds_path = os.path.join(work_folder, "benchmark_credentials.json")
+    with open(creds_path, "w") as f:
+        json.dump({
+            "API_KEY": "benchmark",
+            "CLIENT_SECRET": "benchmark",
+            "ORG_ID": "benchmark@AdobeOrg",
+            "TECHNICAL_ACCOUNT_ID": "benchmark@techacct.adobe.com",
+            "SANDBOX": "benchmark",
+            "PRIVATE_KEY": key_path
+        }, f)
+    return creds_path
+
+
+# Identify the version of lookup_creator.py being measured: the git commit (marked dirty if there are uncommitted
+# changes), or a hash of the script outside a git checkout
+def code_version():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_FOLDER, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "lookup_creator.py"], cwd=SCRIPT_FOLDER, capture_output=True, text=True, check=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "file-" + lookup_creator.part_checksum(os.path.join(SCRIPT_FOLDER, "lookup_creator.py"))[:12]
+
+
+# Time converting a file to json part files in this process with the given engine, then delete the part files
+def benchmark_conversion(file_path, engine, workers, part_size_mb):
+    layout = lookup_creator.inspect_file(file_path)
+    counts = {}
+    conversion_start = time.perf_counter()
+    json_file_paths = lookup_creator.csv_to_json(file_path, "_benchmark", "benchmark_lookup", layout, part_size_mb*1024*1024, workers, engine=engine, counts=counts)
+    seconds = time.perf_counter() - conversion_start
+    if json_file_paths is None:
+        return None
+
+    for json_file_path in json_file_paths:
+        os.remove(json_file_path)
+    return {"seconds": round(seconds, 3), "rows": counts.get("rows", 0), "output_bytes": counts.get("bytes", 0)}
+
+
+# Time a full run of lookup_creator.py (auth, schema class, field group, schema, dataset, conversion, upload and close)
+# against the mock Platform API, with the time of each stage taken from its --metrics_file
+def benchmark_pipeline(file_path, engine, api, creds_path, work_folder, lookup_options):
+    metrics_path = os.path.join(work_folder, "benchmark_metrics.json")
+    command = [
+        sys.executable, os.path.join(SCRIPT_FOLDER, "lookup_creator.py"),
+        "--file_path", file_path,
+        "--dataset_name", f"benchmark {os.path.basename(file_path)}",
+        "--creds_file", creds_path,
+        "--platform_url", api.url,
+        "--ims_url", api.url,
+        "--no_cache",
+        "--engine", engine,
+        "--metrics_file", metrics_path,
+    ] + lookup_options
+
+    run_start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    seconds = time.perf_counter() - run_start
+    if result.returncode != 0:
+        print(f"lookup_creator.py exited with status {result.returncode}:\n{result.stdout[-2000:]}{result.stderr[-2000:]}")
+        return None
+
+    with open(metrics_path) as f:
+        report = json.load(f)
+    stages = {}
+    rows = 0
+    for stage in report["stages"]:
+        stages[stage["stage"]] = round(stages.get(stage["stage"], 0) + stage["seconds"], 3)
+        if stage["stage"] in ("conversion", "convert_and_upload"):
+            rows += stage.get("rows", 0)
+    return {
+        "seconds": round(seconds, 3),
+        "rows": rows,
+        "stages": stages,
+        "http_retries": sum(stage["http_retries"] for stage in report["stages"]),
+        "peak_rss_bytes": report["peak_rss_bytes"],
+    }
+
+
+# Fields that identify what a result measured, so results of the same case from different versions can be compared
+def case_key(result):
+    return tuple(result.get(field) for field in ("benchmark", "file_format", "shape", "rows", "engine", "workers", "latency_ms", "throttle_rate", "pipeline"))
+
+
+def read_results(results_path):
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_results(results_path, results):
+    os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+    with open(results_path, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+
+# Print each result next to the latest result of the same case from another version, flagging ones that got slower
+# by more than threshold. Returns the number of regressions.
+def compare_results(results, earlier_results, threshold):
+    regressions = 0
+    for result in results:
+        previous = next((earlier for earlier in reversed(earlier_results) if case_key(earlier) == case_key(result) and earlier["version"] != result["version"]), None)
+        label = f"{result['benchmark']:<10} {result['file_format']:<9} {result['shape']:<6} {result['rows']:>10} rows  {result['engine']:<6}"
+        line = f"{label} {result['seconds']:>9.3f}s {result['rows_per_second']:>12,.0f} rows/s"
+        if previous is not None and previous["seconds"] > 0:
+            change = result["seconds"]/previous["seconds"] - 1
+            line += f"  {change:+.1%} vs {previous['version']}"
+            if change > threshold:
+                line += "  REGRESSION"
+                regressions += 1
+        print(line)
+    return regressions
+
+
+# Main function
+def main(args):
+    engines = args.engines.split(",")
+    if "arrow" in engines:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("pyarrow isn't installed, so the arrow engine is skipped.")
+            engines.remove("arrow")
+
+    work_folder = args.work_dir or tempfile.mkdtemp(prefix="lookup_creator_benchmark_")
+    os.makedirs(work_folder, exist_ok=True)
+    version = code_version()
+    print(f"Benchmarking lookup_creator.py version {version} in {work_folder}...")
+
+    lookup_options = ["--upload_workers", str(args.upload_workers), "--part_size_mb", str(args.part_size_mb), "--workers", str(args.workers)]
+    if args.pipeline:
+        lookup_options.append("--pipeline")
+
+    api = None
+    creds_path = None
+    if not args.skip_pipeline:
+        api = MockPlatformAPI(args.latency_ms/1000, args.throttle_rate).start()
+        creds_path = write_benchmark_credentials(work_folder)
+        print(f"Mock Platform API listening on {api.url} ({args.latency_ms}ms latency, {args.throttle_rate:.0%} of calls throttled).")
+
+    results = []
+    try:
+        for file_format in args.formats.split(","):
+            for shape in args.shapes.split(","):
+                for rows in [int(row_count) for row_count in args.rows.split(",")]:
+                    # Generated files are kept in --work_dir between runs, since generating the big ones takes a while
+                    file_path = os.path.join(work_folder, f"{file_format.replace('.', '_')}_{shape}_{rows}{FILE_FORMATS[file_format]}")
+                    if not os.path.exists(file_path):
+                        print(f"Generating {os.path.basename(file_path)}...")
+                        generate_lookup_file(file_path, file_format, rows, FILE_SHAPES[shape])
+                    case = {
+                        "version": version,
+                        "recorded_at": datetime.now(timezone.utc).isoformat(),
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "file_format": file_format,
+                        "shape": shape,
+                        "rows": rows,
+                        "file_bytes": os.path.getsize(file_path),
+                        "workers": args.workers,
+                    }
+
+                    for engine in engines:
+                        print(f"Converting {os.path.basename(file_path)} with the {engine} engine...")
+                        conversion = benchmark_conversion(file_path, engine, args.workers, args.part_size_mb)
+                        if conversion is not None:
+                            results.append(dict(case, benchmark="conversion", engine=engine, **conversion))
+
+                        if api is not None:
+                            print(f"Loading {os.path.basename(file_path)} into the mock Platform API with the {engine} engine...")
+                            pipeline = benchmark_pipeline(file_path, engine, api, creds_path, work_folder, lookup_options)
+                            if pipeline is not None:
+                                results.append(dict(case, benchmark="pipeline", engine=engine, latency_ms=args.latency_ms, throttle_rate=args.throttle_rate, pipeline=args.pipeline, **pipeline))
+    finally:
+        if api is not None:
+            api.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    for result in results:
+        result["rows_per_second"] = round(result["rows"]/result["seconds"], 1) if result["seconds"] > 0 else None
+        result["mb_per_second"] = round(result["file_bytes"]/result["seconds"]/1024/1024, 2) if result["seconds"] > 0 else None
+
+    earlier_results = read_results(args.results_file)
+    append_results(args.results_file, results)
+    print(f"Saved {len(results)} result(s) to {args.results_file}.")
+    regressions = compare_results(results, earlier_results, args.regression_threshold)
+    if regressions:
+        print(f"{regressions} result(s) are more than {args.regression_threshold:.0%} slower than the previous version.")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark lookup_creator.py: time converting synthetic csv and SAINT files with each engine, and full loads against a local mock of the Platform API. Results are saved so versions can be compared.')
+    parser.add_argument('--rows', type=str, default="10000,100000", help='Comma separated numbers of rows to generate files with, e.g. 10000,1000000,50000000 (default 10000,100000)')
+    parser.add_argument('--formats', type=str, default=",".join(FILE_FORMATS), help=f'Comma separated file formats to generate (default {",".join(FILE_FORMATS)})')
+    parser.add_argument('--shapes', type=str, default=",".join(FILE_SHAPES), help=f'Comma separated file shapes: narrow ({FILE_SHAPES["narrow"]} columns) and/or wide ({FILE_SHAPES["wide"]} columns) (default both)')
+    parser.add_argument('--engines', type=str, default="python,arrow", help='Comma separated parsing engines to time (default python,arrow; arrow is skipped if pyarrow isn\'t installed)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to convert each file (default 1)')
+    parser.add_argument('--part_size_mb', type=int, default=lookup_creator.DEFAULT_PART_SIZE_MB, help=f'Maximum size in MB of each part file (default {lookup_creator.DEFAULT_PART_SIZE_MB})')
+    parser.add_argument('--upload_workers', type=int, default=lookup_creator.DEFAULT_UPLOAD_WORKERS, help=f'Number of parts uploaded at the same time in full loads (default {lookup_creator.DEFAULT_UPLOAD_WORKERS})')
+    parser.add_argument('--pipeline', action='store_true', help='Run full loads with --pipeline')
+    parser.add_argument('--skip_pipeline', action='store_true', help='Only time conversion, without full loads against the mock Platform API')
+    parser.add_argument('--latency_ms', type=float, default=0, help='Milliseconds the mock Platform API waits before answering each call (default 0)')
+    parser.add_argument('--throttle_rate', type=float, default=0, help='Fraction of Platform API calls the mock answers with 429 Too Many Requests, between 0 and 1 (default 0)')
+    parser.add_argument('--work_dir', type=str, help='Folder to generate files in and keep them for later runs (default: a temporary folder that is deleted afterwards)')
+    parser.add_argument('--results_file', type=str, default=DEFAULT_RESULTS_PATH, help=f'File the results are appended to, one JSON record per line (default {DEFAULT_RESULTS_PATH})')
+    parser.add_argument('--regression_threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD, help=f'Exit with a nonzero status if a case is slower than in the previous version by more than this fraction (default {DEFAULT_REGRESSION_THRESHOLD})')
+
+    args = parser.parse_args()
+    unknown_formats = set(args.formats.split(",")) - set(FILE_FORMATS)
+    if unknown_formats:
+        parser.error(f"unknown --formats: {', '.join(sorted(unknown_formats))}")
+    unknown_shapes = set(args.shapes.split(",")) - set(FILE_SHAPES)
+    if unknown_shapes:
+        parser.error(f"unknown --shapes: {', '.join(sorted(unknown_shapes))}")
+    sys.exit(main(args))
@@ -1,108 +1,774 @@
 import argparse
 import json
 import time
-import jwt
 import requests
+import bz2
+import codecs
 import csv
+import gzip
+import hashlib
+import io
+import locale
+import math
+import mmap
 import os
-from requests_toolbelt.multipart.encoder import MultipartEncoder
+import random
+import re
+import signal
+import sqlite3
+import sys
+import tempfile
+import threading
+import zipfile
+import zlib
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import date, datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlparse
+from requests.adapters import HTTPAdapter
+
+# resource measures peak memory for the run metrics; it isn't available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
 
 ### STEPS ###
 # 1. Read headers from CSV file
 # 2. Generate access token
 # 3. Fetch AEP schema class list looking for "Generic CJA Lookup" class
 # 4. If it doesn't exist, create a "Generic CJA Lookup" schema class
-# 5. Create a fieldgroup to match our csv lookup columns
-# 6. Create a schema using the schema class and field group we just created
-# 7. Create a dataset using our schema we just created
-# 8. Convert the csv file into json format
-# 9. Upload our josn data into our dataset
+# 5. Create a fieldgroup to match our csv lookup columns (or reuse the existing one if the columns haven't changed)
+# 6. Create a schema using the schema class and field group we just created (or reuse the existing one)
+# 7. Create a dataset using our schema we just created (or reuse the existing one)
+# 8. Convert the csv file into json format, split into part files of bounded size
+# 9. Upload our josn data parts into our dataset
 
 # Command line invoke:
 # python your_script.py --file_path "/path/to/file.csv" --dataset_name "dataset_name" --creds "/path/to/credentials.json"
 
-# Global Credentials
-api_key = None
-client_secret = None
-org_id = None
-technical_account_id = None
-sandbox = None
-private_key = None
-access_token = None
-
-# Generate Access Token
-def get_access_token():
-    expiration = int(time.time()) + 24*60*60
-    claim = {
-        "exp": expiration,
-        "iss": org_id,
-        "sub": technical_account_id,
-        "https://ims-na1.adobelogin.com/s/ent_dataservices_sdk": True,
-        "https://ims-na1.adobelogin.com/s/ent_cja_sdk": True,
-        "aud": f"https://ims-na1.adobelogin.com/c/{api_key}"
-    }
-    jwt_token = jwt.encode(claim, private_key, algorithm='RS256')
-    
-    payload = MultipartEncoder({
-        "client_id": api_key,
-        "client_secret": client_secret,
-        "jwt_token": jwt_token
-    })
-    
-    response = requests.post(
-        "https://ims-na1.adobelogin.com/ims/exchange/jwt",
-        headers={"Content-Type": payload.content_type},
-        data=payload
-    )
-    access_token = json.loads(response.text)['access_token']
-    return access_token
+# Library use, loading with the command line defaults for any option not given:
+# client = LookupClient(**load_credentials("/path/to/credentials.json"), cache=LookupCache(DEFAULT_CACHE_PATH))
+# client.load_lookup("/path/to/file.csv", "dataset_name", lookup_options(pipeline=True))
+
+# Default size of each json part file uploaded to a batch (AEP caps single request file uploads at 256MB)
+DEFAULT_PART_SIZE_MB = 128
+
+# Default number of json parts uploaded to a batch at the same time
+DEFAULT_UPLOAD_WORKERS = 4
+
+# Number of rows in each parquet row group
+ROWS_PER_ROW_GROUP = 100000
+
+# Default compression level for each supported part compression, and the file extension compressed parts are uploaded with
+DEFAULT_COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+# Size of the chunks a part file is read in while compressing it
+COMPRESSION_CHUNK_SIZE = 1024*1024
+
+# Number of converted rows serialized and written together in one block
+ROWS_PER_WRITE = 1000
+
+# Size of the chunks read while counting quotes to find shard boundaries
+SHARD_SCAN_CHUNK_SIZE = 16*1024*1024
+
+# Column types that can be inferred, in the order they're preferred when a column's values fit more than one, with the
+# pattern every non-empty value in the column has to match
+TYPE_PRIORITY = ["boolean", "integer", "number", "date"]
+TYPE_PATTERNS = {
+    "boolean": re.compile(r'(?i)true|false'),
+    "integer": re.compile(r'-?(0|[1-9][0-9]*)'),  # No leading zeros, which would be lost
+    "number": re.compile(r'-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?'),
+    "date": re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}'),
+}
+
+# Parse a boolean cell, raising ValueError (like int and float) for anything but true or false in any case
+def parse_boolean(value):
+    lowered = value.lower()
+    if lowered not in ("true", "false"):
+        raise ValueError(f"Not a boolean: {value!r}")
+    return lowered == "true"
+
+# Parse an integer cell, raising ValueError for anything its pattern rejects (like 007 or 1_000, which int accepts) or that
+# doesn't fit in 64 bits
+def parse_integer(value):
+    if not TYPE_PATTERNS["integer"].fullmatch(value):
+        raise ValueError(f"Not an integer: {value!r}")
+    number = int(value)
+    if not -2**63 <= number < 2**63:
+        raise ValueError(f"Integer out of 64-bit range: {value!r}")
+    return number
+
+# Parse a number cell, raising ValueError for anything its pattern rejects (like nan or inf, which float accepts) or that
+# overflows to infinity
+def parse_number(value):
+    if not TYPE_PATTERNS["number"].fullmatch(value):
+        raise ValueError(f"Not a number: {value!r}")
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"Number out of range: {value!r}")
+    return number
+
+# Convert a cell value to the native value written for its column type (dates stay ISO strings, as XDM stores them)
+TYPE_CONVERTERS = {
+    "boolean": parse_boolean,
+    "integer": parse_integer,
+    "number": parse_number,
+}
+
+# XDM field definition used in the field group for each column type
+XDM_FIELD_TYPES = {
+    "string": {"type": "string"},
+    "boolean": {"type": "boolean"},
+    "integer": {"type": "integer"},
+    "number": {"type": "number"},
+    "date": {"type": "string", "format": "date"},
+}
+
+# Default number of rows sampled to infer column types
+DEFAULT_TYPE_SAMPLE_ROWS = 10000
+
+# Characters escaped when the arrow engine serializes string columns to json, in the order they're replaced (backslashes
+# first), and the bytes that never need escaping
+JSON_ESCAPES = [('\\', '\\\\'), ('"', '\\"'), ('\n', '\\n'), ('\r', '\\r'), ('\t', '\\t')]
+JSON_PLAIN_BYTES = bytes(range(0x20, 0x100))
+
+# Byte order mark some editors (Excel among them) put at the start of UTF-8 files
+UTF8_BOM = codecs.BOM_UTF8
+
+# Longest cell, in characters, that pre-flight validation lets through
+DEFAULT_MAX_FIELD_LENGTH = 32*1024
+
+# Characters standing in for bytes that aren't valid in a file's encoding when it's decoded for validation
+INVALID_BYTES = re.compile('[\udc80-\udcff]')
+
+# Number of bytes from the start of a file checked to pick its encoding (and decompressed to find a compressed file's layout)
+ENCODING_SAMPLE_SIZE = 1024*1024
+
+# Compressed lookup files read without decompressing them to disk, by file extension
+COMPRESSED_EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".zip": "zip"}
+
+# File path that reads the lookup file from standard input
+STDIN_PATH = "-"
+
+# Delimiters recognized in csv files, and quoted cells (which may contain any of them)
+CSV_DELIMITERS = [',', '\t', ';', '|']
+QUOTED_CELL = re.compile(r'"[^"]*"')
+
+# Number of bytes the arrow engine parses at a time
+ARROW_BLOCK_SIZE = 4*1024*1024
+
+# Any character that isn't a standard ASCII letter, number, or underscore
+INVALID_FIELD_CHARACTERS = re.compile(r'[^A-Za-z0-9_]')
+
+# Default (connect, read) timeouts in seconds for Platform API calls
+DEFAULT_TIMEOUT = (10, 300)
+
+# Default number of times a throttled or failed Platform API call is retried
+DEFAULT_MAX_RETRIES = 5
+
+# Base delay in seconds for exponential backoff between retries, and the longest we'll wait between two attempts
+RETRY_BACKOFF_SECONDS = 1
+RETRY_MAX_DELAY_SECONDS = 120
+
+# Response status codes worth retrying: throttling and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Platform API endpoints that share a client side request budget, by the start of their path. AEP throttles each of these
+# services separately. IMS isn't rate limited.
+RATE_LIMIT_CATEGORIES = {
+    "/data/foundation/schemaregistry/": "schema_registry",
+    "/data/foundation/catalog/": "catalog",
+    "/data/foundation/import/": "ingestion",
+}
+
+# How often the status of a closed batch is polled: every BATCH_POLL_MIN_SECONDS at first, backing off while the status
+# doesn't change, and for how long by default before giving up
+BATCH_POLL_MIN_SECONDS = 2
+BATCH_POLL_MAX_SECONDS = 60
+BATCH_POLL_BACKOFF_FACTOR = 1.5
+DEFAULT_MONITOR_TIMEOUT_SECONDS = 2*60*60
+
+# Batch statuses once ingestion has finished
+BATCH_SUCCESS_STATUSES = {"success", "active"}
+BATCH_FAILURE_STATUSES = {"failure", "failed", "aborted", "abandoned"}
+
+# Per-stage metrics written in the Prometheus format, and what each one measures
+PROMETHEUS_STAGE_METRICS = [
+    ("seconds", "Wall time spent in the stage"),
+    ("rows", "Rows that went through the stage"),
+    ("bytes", "Bytes written or uploaded by the stage"),
+    ("http_retries", "HTTP calls retried while the stage ran"),
+    ("retry_wait_seconds", "Seconds spent waiting to retry HTTP calls while the stage ran"),
+    ("rate_limit_wait_seconds", "Seconds HTTP calls spent waiting for the client side rate limits while the stage ran"),
+]
+
+# Folder holding the checkpoint journals that let a failed load be resumed
+DEFAULT_CHECKPOINT_FOLDER = os.path.join(os.path.expanduser("~"), ".cja_tools", "checkpoints")
+
+# Number of distinct keys the duplicate key index holds in memory before moving to a temporary sqlite file (about 200 bytes each)
+DEFAULT_DEDUPE_MEMORY_KEYS = 2000000
+
+# Folder holding the per-dataset fingerprint indexes used by refresh loads
+DEFAULT_FINGERPRINT_FOLDER = os.path.join(os.path.expanduser("~"), ".cja_tools", "fingerprints")
+
+# Number of row fingerprints staged in the index at a time
+FINGERPRINT_WRITE_ROWS = 10000
+
+# Base URLs of the Adobe Experience Platform API and of the IMS token service
+DEFAULT_PLATFORM_API_URL = "https://platform.adobe.io"
+DEFAULT_IMS_URL = "https://ims-na1.adobelogin.com"
+
+# Name of the schema class every lookup schema is built on
+STANDARD_SCHEMA_CLASS_NAME = "CJA Generic Lookup Class"
+
+# Default number of lookups loaded at the same time in batch mode
+DEFAULT_MAX_CONCURRENT_LOADS = 4
+
+# Seconds between polls of a watched drop folder
+DEFAULT_WATCH_INTERVAL_SECONDS = 0.5
+
+# Subfolders of a watched drop folder: the ones files are moved to while they load, and once they've loaded or failed to,
+# the one part and quarantine files are written to, and the one relative paths in a dropped manifest are read from (which
+# isn't watched, so the files a manifest lists aren't loaded on their own)
+DROP_FOLDER_SUBFOLDERS = ("processing", "processed", "failed", "work", "job_files")
+
+# Files in a drop folder that are still being written by the tool copying them in, and are never picked up
+DROP_FOLDER_PARTIAL_EXTENSIONS = (".tmp", ".part", ".partial", ".crdownload", ".filepart")
+
+# Files in a drop folder read as manifests of jobs rather than loaded as lookup files
+MANIFEST_EXTENSIONS = (".json", ".yaml", ".yml")
+
+# Default location of the cache of access tokens and schema class lookups shared between runs
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cja_tools", "lookup_creator_cache.json")
+
+# Seconds before an access token's real expiry that we stop using the cached copy
+TOKEN_EXPIRY_MARGIN_SECONDS = 10*60
+
+# How long a cached schema class ID and tenant ID are reused before being looked up again
+SCHEMA_CLASS_CACHE_TTL_SECONDS = 7*24*60*60
+
+
+# One pooled keep-alive requests.Session shared by every Platform API call a LookupClient makes, with default timeouts
+# and retries on throttling and transient errors using exponential backoff that honors Retry-After. Every attempt is
+# paced by rate_limits (a PlatformRateLimits), if given.
+class PlatformSession:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, pool_size=DEFAULT_UPLOAD_WORKERS, rate_limits=None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limits = rate_limits
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(pool_size, 10))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.retry_count = 0
+        self.retry_seconds = 0.0
+        self.retry_lock = threading.Lock()
+        # Called with no arguments to fetch a new access token when a call comes back 401 Unauthorized
+        self.refresh_credentials = None
+        self.refresh_lock = threading.Lock()
+
+    # Set the headers every Platform API call needs so each call only passes its own content headers
+    def set_credentials(self, org_id, sandbox, api_key, access_token):
+        self.session.headers.update({
+            "x-gw-ims-org-id": org_id,
+            "x-sandbox-name": sandbox,
+            "Authorization": f"Bearer {access_token}",
+            "x-api-key": api_key
+        })
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        # Streamed bodies have to be rewound before they can be sent again, and can't be retried if they aren't seekable
+        body = kwargs.get("data")
+        body_start = body.tell() if hasattr(body, "seek") else None
+        can_retry = not hasattr(body, "read") or body_start is not None
+
+        attempt = 0
+        refreshed = False
+        while True:
+            if self.rate_limits is not None:
+                self.rate_limits.acquire(url, request_body_size(body))
+            try:
+                authorization = self.session.headers.get("Authorization")
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries or not can_retry:
+                    raise
+                delay = retry_delay(attempt)
+                print(f"{method} {url} failed ({e}). Retrying in {delay:.1f}s...")
+            else:
+                if response.status_code == 401 and self.refresh_credentials and not refreshed and can_retry:
+                    # The token expired or was revoked, so get a new one (once, even if several workers got a 401) and resend
+                    with self.refresh_lock:
+                        if self.session.headers.get("Authorization") == authorization:
+                            print("Access token was rejected. Fetching a new one...")
+                            self.refresh_credentials()
+                    refreshed = True
+                    if body_start is not None:
+                        body.seek(body_start)
+                    continue
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries or not can_retry:
+                    return response
+                delay = retry_delay(attempt, response.headers.get("Retry-After"))
+                print(f"{method} {url} returned status code {response.status_code}. Retrying in {delay:.1f}s...")
+
+            with self.retry_lock:
+                self.retry_count += 1
+                self.retry_seconds += delay
+            time.sleep(delay)
+            if body_start is not None:
+                body.seek(body_start)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+
+# Number of bytes a request body sends: all of it for bytes, or the rest of a file from where it's positioned. Other
+# bodies (json payloads and the IMS token form) are small and counted as 0.
+def request_body_size(body):
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return len(body)
+    if hasattr(body, "fileno") and hasattr(body, "tell"):
+        try:
+            return max(os.fstat(body.fileno()).st_size - body.tell(), 0)
+        except (OSError, io.UnsupportedOperation):
+            return 0
+    return 0
+
+
+# Token bucket pacing calls (or bytes) to a steady rate per second, letting up to one second's worth through at once.
+# Each caller reserves what it needs, driving the bucket below empty if it has to, and sleeps off the shortfall outside
+# the lock, so concurrent callers are spaced out in the order they asked instead of bursting and all being throttled
+# together. Also counts how often and how long callers waited.
+class TokenBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    # Take amount tokens, waiting until the bucket has refilled enough to cover them. Returns the seconds waited.
+    def acquire(self, amount=1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at)*self.rate)
+            self.updated_at = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if delay:
+                self.waits += 1
+                self.wait_seconds += delay
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+# Client side budgets for AEP's per-org quotas: requests per second to each group of endpoints in RATE_LIMIT_CATEGORIES,
+# and upload bytes per second. One instance is shared by every call of every load in a run (and can be shared by several
+# LookupClients for the same org), so concurrent loads pace themselves against the same budget. A rate of None isn't
+# limited.
+class PlatformRateLimits:
+    def __init__(self, schema_registry_rate=None, catalog_rate=None, ingestion_rate=None, upload_bytes_rate=None):
+        rates = {"schema_registry": schema_registry_rate, "catalog": catalog_rate, "ingestion": ingestion_rate, "upload_bytes": upload_bytes_rate}
+        self.buckets = {name: TokenBucket(rate) for name, rate in rates.items() if rate}
+
+    # Wait for the budget of a call to url sending body_size bytes. Returns the seconds waited.
+    def acquire(self, url, body_size=0):
+        waited = 0.0
+        path = urlparse(url).path
+        for prefix, category in RATE_LIMIT_CATEGORIES.items():
+            if path.startswith(prefix) and category in self.buckets:
+                waited += self.buckets[category].acquire()
+        if body_size and "upload_bytes" in self.buckets:
+            waited += self.buckets["upload_bytes"].acquire(body_size)
+        return waited
+
+    # How often and how long calls have waited for each budget so far: {name: {"waits": ..., "wait_seconds": ...}}
+    def totals(self):
+        return {name: {"waits": bucket.waits, "wait_seconds": round(bucket.wait_seconds, 3)} for name, bucket in self.buckets.items()}
+
+    def wait_seconds(self):
+        return sum(bucket.wait_seconds for bucket in self.buckets.values())
+
+
+# Work out how long to wait before the next retry, preferring the server's Retry-After (seconds or an HTTP date) and
+# otherwise backing off exponentially with jitter so concurrent workers don't retry in lockstep
+def retry_delay(attempt, retry_after=None):
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY_SECONDS)
+        except ValueError:
+            try:
+                return min(max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0), RETRY_MAX_DELAY_SECONDS)
+            except (TypeError, ValueError):
+                pass
+    delay = RETRY_BACKOFF_SECONDS * 2**attempt
+    return min(delay + random.uniform(0, delay/2), RETRY_MAX_DELAY_SECONDS)
+
+# Small on-disk json cache of values that are slow to fetch but rarely change (access tokens, schema class IDs, tenant IDs).
+# Each entry has its own expiry, and the file is only readable by the current user since it holds access tokens.
+class LookupCache:
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        try:
+            with open(cache_path, 'r') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry["expires_at"] <= time.time():
+            return None
+        return entry["value"]
+
+    def expires_at(self, key):
+        entry = self.entries.get(key)
+        return entry["expires_at"] if entry is not None else 0
+
+    def set(self, key, value, ttl_seconds):
+        with self.lock:
+            self.entries[key] = {"value": value, "expires_at": time.time() + ttl_seconds}
+            self.save()
+
+    def invalidate(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.save()
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.save()
+
+    def save(self):
+        # Drop expired entries and write atomically so a concurrent run never reads a half written file
+        now = time.time()
+        self.entries = {key: entry for key, entry in self.entries.items() if entry["expires_at"] > now}
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.cache_path)
+
+
+# What inspect_file found out about a lookup file: its type ("csv", "saint" or "unknown"), text encoding, delimiter,
+# SAINT version, sanitized headers, and the byte offset where the data rows start. For standard input, which can't be read
+# again, it also keeps the start of the input that was read to find all that.
+class FileLayout:
+    def __init__(self, file_type="unknown", encoding="utf-8", delimiter=",", version=None, headers=None, data_start=None, file_size=0):
+        self.file_type = file_type
+        self.encoding = encoding
+        self.delimiter = delimiter
+        self.version = version
+        self.headers = headers
+        self.data_start = data_start
+        self.file_size = file_size
+        self.stdin_sample = None
+
+
+# Lookup files can be read straight from gzip, bz2 or zip compressed files, or from standard input, without being
+# decompressed to disk first. A file in a zip archive holding several files is named by the path of the archive followed
+# by the path of the file inside it, e.g. exports.zip/campaigns.tab. These sources are streamed from the start on every
+# read, so they can't be split across worker processes, and standard input can only be read once.
+def source_compression(file_path):
+    if file_path == STDIN_PATH:
+        return None
+    zip_path, _ = split_zip_path(file_path)
+    if zip_path is not None:
+        return "zip"
+    return COMPRESSED_EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+
+
+# Whether a lookup file is read as a stream (compressed or standard input) rather than from a plain file on disk
+def is_streamed_source(file_path):
+    return file_path == STDIN_PATH or source_compression(file_path) is not None
+
+
+# Split the path of a zip archive, or of a file inside one, into the archive's path and the file's name in it (None for
+# the archive itself). Returns (None, None) if the path isn't in a zip archive.
+def split_zip_path(file_path):
+    if os.path.splitext(file_path)[1].lower() == ".zip":
+        return file_path, None
+    for separator in {"/", os.sep}:
+        zip_end = file_path.lower().rfind(".zip" + separator)
+        if zip_end != -1 and os.path.isfile(file_path[:zip_end + 4]):
+            return file_path[:zip_end + 4], file_path[zip_end + 5:].replace(os.sep, "/")
+    return None, None
+
+
+# Names of the files in a zip archive, leaving out folders and hidden files
+def zip_member_names(zip_path):
+    with zipfile.ZipFile(zip_path) as archive:
+        return [member.filename for member in archive.infolist() if not member.is_dir() and not os.path.basename(member.filename).startswith(".")]
+
+
+# List the lookup files a path holds: every file in a zip archive (as exports.zip/campaigns.tab paths) or just the path
+def expand_lookup_paths(file_path):
+    zip_path, member_name = split_zip_path(file_path)
+    if zip_path is None or member_name is not None:
+        return [file_path]
+    return [f"{zip_path}/{member_name}" for member_name in zip_member_names(zip_path)]
+
+
+# Name of the lookup file a path reads, without any compression extension: "campaigns.tab" for campaigns.tab.gz or for
+# exports.zip/campaigns.tab
+def lookup_file_name(file_path):
+    if file_path == STDIN_PATH:
+        return "stdin"
+    zip_path, member_name = split_zip_path(file_path)
+    if zip_path is not None:
+        member_names = [member_name] if member_name else zip_member_names(zip_path)
+        return os.path.basename(member_names[0]) if len(member_names) == 1 else os.path.basename(zip_path)
+    if source_compression(file_path):
+        return os.path.basename(os.path.splitext(file_path)[0])
+    return os.path.basename(file_path)
+
+
+# Open a lookup file as a binary stream of its decompressed contents from the start. Standard input is read on from
+# stdin_sample, the start of it that was already read.
+def open_source(file_path, stdin_sample=b""):
+    if file_path == STDIN_PATH:
+        return io.BufferedReader(PrefixedReader(stdin_sample, sys.stdin.buffer))
+
+    compression = source_compression(file_path)
+    if compression == "gzip":
+        return gzip.open(file_path, 'rb')
+    if compression == "bz2":
+        return bz2.open(file_path, 'rb')
+    if compression == "zip":
+        zip_path, member_name = split_zip_path(file_path)
+        if member_name is None:
+            member_names = zip_member_names(zip_path)
+            if len(member_names) != 1:
+                raise ValueError(f"{zip_path} holds {len(member_names)} files. Name one as {zip_path}/<file name>, or load them all with --manifest {zip_path}")
+            member_name = member_names[0]
+        # The opened file keeps the archive open until it's closed itself
+        with zipfile.ZipFile(zip_path) as archive:
+            return archive.open(member_name)
+    return open(file_path, 'rb')
+
+
+# Read the start of a lookup file that inspect_file finds its layout in. inspect_file keeps the start of standard input,
+# since it can't be read again, for open_source to read back in front of the rest of it.
+def read_source_sample(file_path):
+    if file_path == STDIN_PATH:
+        return sys.stdin.buffer.read(ENCODING_SAMPLE_SIZE)
+
+    with open_source(file_path) as f:
+        return f.read(ENCODING_SAMPLE_SIZE)
+
+
+# The file on disk a lookup file is read from (the archive for a file in a zip), or None for standard input
+def source_stat(file_path):
+    if file_path == STDIN_PATH:
+        return None
+    zip_path, _ = split_zip_path(file_path)
+    return os.stat(zip_path or file_path)
+
+
+# Read bytes already read from a stream, then the rest of the stream. Closing it leaves the stream open.
+class PrefixedReader(io.RawIOBase):
+    def __init__(self, prefix, stream):
+        self.prefix = memoryview(prefix)
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        return self.stream.readinto(buffer)
+
+
+# Open the data rows of a lookup file (or the byte range of them from start to end) as a binary stream
+def open_lookup_data(file_path, layout, start=None, end=None):
+    start = layout.data_start if start is None else start
+    if not is_streamed_source(file_path):
+        end = layout.file_size if end is None else end
+        return io.BufferedReader(FileRangeReader(file_path, start, end))
+
+    stream = open_source(file_path, layout.stdin_sample)
+    remaining = start
+    while remaining > 0:
+        skipped = len(stream.read(min(remaining, COMPRESSION_CHUNK_SIZE)))
+        if not skipped:
+            break
+        remaining -= skipped
+    return stream
+
+
+# Work out a file's layout in one pass over its start, through a memory map so nothing past the header is read.
+# Records are tracked with the csv module's quoting rules so a quoted header cell containing a newline doesn't throw the
+# data offset off.
+# Compressed files and standard input are decompressed only as far as ENCODING_SAMPLE_SIZE bytes, and their size is None.
+def inspect_file(file_path):
+    layout = FileLayout()
+    _, ext = os.path.splitext(lookup_file_name(file_path))
+    # Standard input has no extension to go by, so anything that isn't a SAINT file is taken as a csv
+    csv_file = file_path == STDIN_PATH or ext.lower() == '.csv'
+
+    if is_streamed_source(file_path):
+        layout.file_size = None
+        sample = read_source_sample(file_path)
+        if file_path == STDIN_PATH:
+            layout.stdin_sample = sample
+        inspect_data(sample, csv_file, layout)
+        return layout
+
+    with open(file_path, 'rb') as f:
+        layout.file_size = os.fstat(f.fileno()).st_size
+        if layout.file_size == 0:
+            return layout
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            inspect_data(data, csv_file, layout)
+
+    return layout
+
+
+# Fill in layout from the start of a file's contents (a memory map or bytes)
+def inspect_data(data, csv_file, layout):
+    position = len(UTF8_BOM) if data[:len(UTF8_BOM)] == UTF8_BOM else 0
+    layout.encoding = detect_encoding(data[position:position + ENCODING_SAMPLE_SIZE])
+
+    # A SAINT file starts with its "## SC" row, otherwise a file with a .csv extension is taken as a csv
+    first_line_end = data.find(b'\n', position)
+    first_line = data[position:len(data) if first_line_end == -1 else first_line_end].decode(layout.encoding, errors='replace').strip()
+    if first_line.startswith("## SC"):
+        layout.file_type = "saint"
+        layout.delimiter = '\t'
+    elif csv_file and len(data) > 0:
+        layout.file_type = "csv"
+    else:
+        return
 
+    while position < len(data):
+        # Where a quoted cell can start depends on the delimiter, so a csv's is sniffed from the first line before its header
+        # record is found, then again from the whole record
+        if layout.file_type == "csv":
+            layout.delimiter = sniff_delimiter(first_line)
+        record_end = find_record_end(data, position, layout.delimiter)
+        record = data[position:record_end].decode(layout.encoding, errors="replace")
+        position = record_end
+
+        if layout.file_type == "csv":
+            layout.delimiter = sniff_delimiter(record)
+        try:
+            row = next(csv.reader([record], delimiter=layout.delimiter), [])
+        except csv.Error as e:
+            raise ValueError(f"the header row can't be parsed ({e})")
+        if layout.file_type == "saint" and row and row[0].startswith("##"):
+            if any("v:2.1" in cell for cell in row):
+                layout.version = "v2.1"
+            elif any("v:2.0" in cell for cell in row):
+                layout.version = "v2.0"
+        elif row or layout.file_type == "csv":
+            layout.headers = sanitize_strings(row)
+            layout.data_start = position
+            break
+
+
+# Track whether the bytes of a csv or SAINT file fed so far end inside a quoted cell, by the csv module's rules: a quote
+# only opens a quoted cell at the start of a cell (so the quote in 5" tv is just a character), a doubled quote inside a
+# quoted cell is a literal quote, and any other quote closes it. Bytes can be fed in chunks of any size.
+class QuoteScanner:
+    def __init__(self, delimiter):
+        self.cell_starts = (delimiter.encode(), b'\n', b'\r')
+        self.in_quotes = False
+        # A quote inside a quoted cell ended the last chunk: it's a literal quote if the next chunk starts with another
+        self.pending_quote = False
+        self.previous_byte = b'\n'
+
+    def feed(self, chunk):
+        position = 0
+        if self.pending_quote:
+            self.pending_quote = False
+            if chunk[:1] == b'"':
+                position = 1
+            else:
+                self.in_quotes = False
+
+        while True:
+            quote = chunk.find(b'"', position)
+            if quote == -1:
+                break
+            position = quote + 1
+            if not self.in_quotes:
+                self.in_quotes = (chunk[quote - 1:quote] if quote else self.previous_byte) in self.cell_starts
+            elif quote + 1 == len(chunk):
+                self.pending_quote = True
+            elif chunk[quote + 1:quote + 2] == b'"':
+                position = quote + 2
+            else:
+                self.in_quotes = False
 
-# Detect whether a file is a SAINT classification file or a csv file
-def detect_file_type(file_path):
-    # Check the file extension
-    _, ext = os.path.splitext(file_path)
+        if chunk:
+            self.previous_byte = chunk[-1:]
 
-    # Open the file to read the first line
-    with open(file_path, 'r') as f:
-        first_line = f.readline().strip()
+    # Whether the bytes fed so far end inside a quoted cell (a quote ending them closes the cell)
+    def in_quoted_cell(self):
+        return self.in_quotes and not self.pending_quote
 
-    # If the extension is .csv and the first line doesn't start with '#', it's likely a CSV
-    if ext.lower() == '.csv' and not first_line.startswith("## SC"):
-        return "csv"
-    # If the first line starts with '#', it's likely a SAINT file
-    elif first_line.startswith("## SC"):
-        return "saint"
-    else:
-        return "unknown"
 
+# Find the end of the record starting at start: the first line end that isn't inside a quoted cell
+def find_record_end(data, start, delimiter):
+    scanner = QuoteScanner(delimiter)
+    end = start
+    while end < len(data):
+        line_end = data.find(b'\n', end)
+        line_end = len(data) if line_end == -1 else line_end + 1
+        scanner.feed(data[end:line_end])
+        end = line_end
+        if not scanner.in_quoted_cell():
+            break
+    return end
 
-# Read headers from a csv or SAINT file
-def read_csv_headers(file_path, file_type):
-    headers = None  # Initialize headers to None
-    
+
+# Pick the encoding of a file from a sample of its start: UTF-8 if the sample decodes as UTF-8, otherwise the system's
+# encoding, or Windows-1252 (what Excel saves csv files as) if the system's encoding is UTF-8 as well
+def detect_encoding(sample):
     try:
-        if file_type == "saint":        
-            with open(file_path, 'r') as file:  # Use the dynamic file_path
-                csv_reader = csv.reader(file, delimiter='\t')  # Assuming the delimiter is a tab character
-                for row in csv_reader:
-                    if row and not row[0].startswith("#"):  # Skip empty rows and rows starting with '#'
-                        headers = row  # This should be your header row
-                        break  # Exit the loop once the header is found
-        
-        elif file_type == "csv":
-            with open(file_path, 'r') as f:
-                reader = csv.reader(f)
-                headers = next(reader)
-        else:
-            print("Invalid file_type argument. Use 'saint' or 'csv'.")
-            
-    except FileNotFoundError:
-        print(f"File {file_path} not found.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        sample.decode('utf-8')
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        if e.start >= len(sample) - 3 and e.reason == "unexpected end of data":
+            return "utf-8"  # The sample ends partway through a character
+
+    system_encoding = locale.getpreferredencoding(False)
+    return system_encoding if codecs.lookup(system_encoding).name != "utf-8" else "cp1252"
+
 
-    return headers
+# Pick the delimiter of a csv file from its header row: a comma unless the header has none outside quoted cells and one
+# of the other common delimiters is there instead
+def sniff_delimiter(header_record):
+    unquoted = QUOTED_CELL.sub('', header_record)
+    if ',' in unquoted:
+        return ','
+    counts = {delimiter: unquoted.count(delimiter) for delimiter in CSV_DELIMITERS}
+    delimiter = max(counts, key=counts.get)
+    return delimiter if counts[delimiter] else ','
 
 
 # Sanitize csv headers so that they only contain letters, numbers, and underscores
@@ -125,7 +791,7 @@ def sanitize_strings(headers):
         header = header.replace(" ", "_")
 
         # Remove any character that is not a standard ASCII letter, number, or underscore
-        header = ''.join(ch for ch in header if ord('a') <= ord(ch) <= ord('z') or ord('A') <= ord(ch) <= ord('Z') or ord('0') <= ord(ch) <= ord('9') or ch == "_")
+        header = INVALID_FIELD_CHARACTERS.sub('', header)
 
         # Lowercase everything
         header = header.lower()
@@ -150,48 +816,840 @@ def sanitize_strings(headers):
         return sanitized_headers
 
 
-# Convert a csv or SAINT file into a json file and return the path to the json file
-def csv_to_json(file_path, tenant_id, lookup_dataset_name, file_type):
-    folder_path = os.path.dirname(file_path)
-    json_file_name = os.path.splitext(os.path.basename(file_path))[0] + '.json'
-    json_file_path = os.path.join(folder_path, json_file_name)
-    
+# Write blocks of json lines into numbered part files, rolling over to a new part once the current one reaches part_size bytes.
+# Parquet output hands over whole part files through write_part instead. If the conversion writing them fails (including
+# when --max_rejected_rows stops it), the part files written so far are deleted on the way out.
+class JsonPartWriter:
+    def __init__(self, base_path, part_size, extension=".json"):
+        self.base_path = base_path
+        self.part_size = part_size
+        self.extension = extension
+        self.part_paths = []
+        self.part_file = None
+        self.part_bytes = 0
+
+    def write(self, data):
+        if self.part_file is None or (self.part_bytes > 0 and self.part_bytes + len(data) > self.part_size):
+            self.next_part()
+        self.part_file.write(data)
+        self.part_bytes += len(data)
+
+    # Write data as a part file of its own
+    def write_part(self, data):
+        self.next_part()
+        self.part_file.write(data)
+        self.close()
+
+    def next_part(self):
+        self.close()
+        part_path = f"{self.base_path}_part{len(self.part_paths):05d}{self.extension}"
+        self.part_file = open(part_path, 'wb')
+        self.part_paths.append(part_path)
+        self.part_bytes = 0
+
+    def close(self):
+        if self.part_file is not None:
+            self.part_file.close()
+            self.part_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        if exc_type is not None:
+            remove_part_files(self.part_paths)
+
+
+# Buffer blocks of json lines into in-memory parts and hand each full part to an upload worker while conversion carries on
+class PipelinedPartUploader:
+    def __init__(self, client, batch_id, dataset_id, part_size, upload_workers, compression=None, compression_level=None, output_format="json", journal=None):
+        self.client = client
+        self.batch_id = batch_id
+        self.journal = journal
+        self.dataset_id = dataset_id
+        self.part_size = part_size
+        self.compression = compression
+        self.compression_level = compression_level
+        self.output_format = output_format
+        self.executor = ThreadPoolExecutor(max_workers=upload_workers)
+        # Bound memory to the parts being uploaded, one queued part and the part being filled
+        self.part_slots = threading.BoundedSemaphore(upload_workers + 1)
+        self.part_buffer = bytearray()
+        self.part_count = 0
+        self.uploaded_bytes = 0
+        self.uploaded_bytes_lock = threading.Lock()
+        self.futures = []
+
+    def write(self, data):
+        if self.part_buffer and len(self.part_buffer) + len(data) > self.part_size:
+            self.flush()
+        self.part_buffer += data
+
+    # Upload data as a part of its own
+    def write_part(self, data):
+        self.flush()
+        self.part_buffer += data
+        self.flush()
+
+    def flush(self):
+        if not self.part_buffer:
+            return
+        part_data = bytes(self.part_buffer)
+        self.part_buffer = bytearray()
+        self.part_slots.acquire()  # Blocks conversion while every slot is still uploading
+        part_number = self.part_count
+        self.part_count += 1
+        self.futures.append(self.executor.submit(self.upload_part, part_number, part_data))
+
+    def upload_part(self, part_number, part_data):
+        try:
+            # Parts are converted the same way every run, so a part uploaded before a resumed run has the same checksum
+            checksum = part_checksum(part_data) if self.journal is not None else None
+            if checksum is not None and self.journal.uploaded_checksum(part_number) == checksum:
+                print(f"Part {part_number + 1} was already uploaded before resuming. Skipping...")
+                return True
+
+            part_start = time.time()
+            upload_data = compress_part(part_data, self.compression, self.compression_level) if self.compression else part_data
+            uploaded = self.client.upload_json_part(self.batch_id, self.dataset_id, part_number, upload_data, self.compression, self.output_format)
+            if uploaded:
+                print(f"Uploaded part {part_number + 1} ({describe_part_size(len(part_data), len(upload_data))} in {time.time() - part_start:.1f}s).")
+                with self.uploaded_bytes_lock:
+                    self.uploaded_bytes += len(upload_data)
+                if checksum is not None:
+                    self.journal.record_upload(part_number, checksum)
+            return uploaded
+        except requests.RequestException as e:
+            print(f"Failed to upload part {part_number + 1}: {e}")
+            return False
+        finally:
+            self.part_slots.release()
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown(wait=True)
+        return all(future.result() for future in self.futures)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # Don't start uploading a half converted part if conversion failed
+            self.part_buffer = bytearray()
+        self.executor.shutdown(wait=True)
+
+
+# Narrow down the type of each column from the rows given: a column keeps a type only while every non-empty value in it
+# parses as that type. The first of headers is the lookup key and always stays a string, as does a column with no non-empty
+# values to go by (short rows have no value for their missing columns). Returns {header: type} using the types in
+# XDM_FIELD_TYPES.
+def infer_column_types(rows, headers):
+    candidates = {header: set(TYPE_PATTERNS) for header in headers[1:]}
+    filled_headers = set()
+    for row in rows:
+        for header, remaining in candidates.items():
+            if not remaining:
+                continue
+            value = row.get(header)
+            if value:
+                filled_headers.add(header)
+                remaining.intersection_update([column_type for column_type in remaining if value_matches_type(value, column_type)])
+
+    column_types = {}
+    for header, remaining in candidates.items():
+        if header not in filled_headers:
+            column_types[header] = "string"
+            continue
+        column_types[header] = next((column_type for column_type in TYPE_PRIORITY if column_type in remaining), "string")
+    return column_types
+
+
+# Check whether a cell value can be stored as the given type
+def value_matches_type(value, column_type):
     try:
-        with open(json_file_path, 'w') as json_file:
-            if file_type == "csv":
-                with open(file_path, 'r') as csv_file:
-                    csv_reader = csv.DictReader(csv_file)
-                    csv_reader.fieldnames = sanitize_strings(csv_reader.fieldnames)
-                    for row in csv_reader:
-                        write_to_json(json_file, row, tenant_id, lookup_dataset_name)
-            
-            elif file_type == "saint":
-                version = None  # Initialize version to None
-                with open(file_path, 'r') as saint_file:
-                    csv_reader = csv.reader(saint_file, delimiter='\t')
-                    headers = None
-                    for row in csv_reader:
-                        if row and row[0].startswith("##"):
-                            if any("v:2.1" in cell for cell in row):
-                                version = "v2.1"
-                                print("Detected v2.1 SAINT file.")
-                            elif any("v:2.0" in cell for cell in row):
-                                version = "v2.0"
-                                print("Detected v2.0 SAINT file.")
-                        elif row:
-                            if headers is None:
-                                headers = row
-                                headers = sanitize_strings(headers)
-                            else:
-                                row_dict = dict(zip(headers, row))
-                                if version == "v2.1":
-                                    # For v2.1, strip exterior quotes and replace double interior quotes with single quotes
-                                    row_dict = {k: v.strip('"').replace('""', '"') for k, v in row_dict.items()}
-                                # For v2.0 or if version is not specified, keep as is
-                                write_to_json(json_file, row_dict, tenant_id, lookup_dataset_name)
+        if column_type == "date":
+            if not TYPE_PATTERNS["date"].fullmatch(value):
+                return False
+            date.fromisoformat(value)
+        else:
+            TYPE_CONVERTERS[column_type](value)
+    except ValueError:
+        return False
+    return True
+
+
+# Convert each typed column's cell values to native values (empty cells become null). Values that don't parse (possible when
+# types were inferred from a sample) are written as null and counted in mismatches["count"].
+def convert_row_types(rows, column_types, mismatches):
+    converters = {header: TYPE_CONVERTERS[column_type] for header, column_type in column_types.items() if column_type in TYPE_CONVERTERS}
+    for row in rows:
+        for header, converter in converters.items():
+            value = row.get(header)
+            if value:
+                try:
+                    row[header] = converter(value)
+                except ValueError:
+                    row[header] = None
+                    mismatches["count"] += 1
+            elif header in row:
+                row[header] = None
+        yield row
+
+
+# The orjson module, or None if it isn't installed. orjson is optional; when it's installed rows are serialized with it
+# instead of the standard json module. It's imported the first time rows are serialized rather than when this module is.
+@lru_cache(maxsize=None)
+def optional_orjson():
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+# Serialize rows into nested json lines. The dataset name is sanitized and the constant {tenant_id: {dataset_name: ...}}
+# wrapper is built once up front, so the only per row work is serializing the row itself.
+class JsonRowEncoder:
+    def __init__(self, tenant_id, lookup_dataset_name):
+        sanitized_lookup_name = sanitize_strings(lookup_dataset_name)
+        self.orjson = orjson = optional_orjson()
+        if orjson is not None:
+            self.prefix = b'{' + orjson.dumps(tenant_id) + b':{' + orjson.dumps(sanitized_lookup_name) + b':'
+        else:
+            self.prefix = ('{' + json.dumps(tenant_id) + ': {' + json.dumps(sanitized_lookup_name) + ': ').encode('utf-8')
+            self.dumps = json.JSONEncoder().encode
+        self.suffix = b'}}\n'
+
+    # Encode a list of rows into one block of newline delimited json
+    def encode_rows(self, rows):
+        prefix = self.prefix
+        suffix = self.suffix
+        orjson = self.orjson
+        if orjson is not None:
+            dumps = orjson.dumps
+            return b''.join([prefix + dumps(row, option=orjson.OPT_NON_STR_KEYS) + suffix for row in rows])
+        else:
+            # json.dumps escapes non-ASCII characters by default, so the whole block can be encoded at once
+            prefix = prefix.decode('utf-8')
+            suffix = suffix.decode('utf-8')
+            dumps = self.dumps
+            return ''.join([prefix + dumps(row) + suffix for row in rows]).encode('utf-8')
+
+    # Encode a block of rows from the arrow engine into one block of newline delimited json. Each line is built with
+    # vectorized string operations over whole columns, escaping only the characters a column actually holds; blocks holding
+    # floats or control characters other than newlines and tabs are encoded row by row instead. Non-ASCII characters are
+    # written as UTF-8 rather than escaped.
+    def encode_block(self, block):
+        import pyarrow as pa  # Optional, only needed for the arrow engine
+        import pyarrow.compute as pc
+
+        item_separator, key_separator = (',', ':') if self.orjson is not None else (', ', ': ')
+        literal = self.prefix.decode('utf-8') + '{'
+        parts = []
+        for header_number, (header, column) in enumerate(zip(block.schema.names, block.columns)):
+            literal += (item_separator if header_number else '') + json.dumps(header) + key_separator
+            if pa.types.is_string(column.type):
+                data = column.buffers()[2]
+                data = data.to_pybytes() if data is not None else b''
+                if data.translate(None, JSON_PLAIN_BYTES).strip(b'\n\r\t'):
+                    return self.encode_rows(block.to_pylist())
+                for character, escaped in JSON_ESCAPES:
+                    if character.encode('utf-8') in data:
+                        column = pc.replace_substring(column, character, escaped)
+                if column.null_count:
+                    parts += [literal, pc.fill_null(pc.binary_join_element_wise('"', column, '"', ''), 'null')]
+                    literal = ''
+                else:
+                    # Put the quotes around the values in the literals on either side
+                    parts += [literal + '"', column]
+                    literal = '"'
+            elif pa.types.is_integer(column.type) or pa.types.is_boolean(column.type):
+                parts += [literal, pc.fill_null(pc.cast(column, pa.string()), 'null')]
+                literal = ''
+            else:
+                return self.encode_rows(block.to_pylist())
+
+        if not parts:
+            return self.encode_rows(block.to_pylist())
+        lines = pc.binary_join_element_wise(*parts, literal + '}' + self.suffix.decode('utf-8'), '')
+
+        # The lines of the array sit back to back in its data buffer
+        offsets = pa.Array.from_buffers(pa.int32(), len(lines) + 1, [None, lines.buffers()[1]], offset=lines.offset)
+        return lines.buffers()[2][offsets[0].as_py():offsets[-1].as_py()].to_pybytes()
+
+
+# Yield csv rows as dicts keyed by the sanitized headers
+def iter_csv_rows(csv_reader, headers):
+    header_count = len(headers)
+    for row in csv_reader:
+        if len(row) == header_count:
+            yield dict(zip(headers, row))
+        elif row:
+            # Match csv.DictReader: missing cells are None and extra cells are collected under a None key
+            row_dict = dict(zip(headers, row))
+            if len(row) < header_count:
+                for header in headers[len(row):]:
+                    row_dict[header] = None
+            else:
+                row_dict[None] = row[header_count:]
+            yield row_dict
+
+
+# Yield SAINT rows as dicts keyed by the sanitized headers, picking up the version and header rows as they are reached
+# unless they are passed in (as they are when converting a shard that starts partway through the file)
+def iter_saint_rows(csv_reader, headers=None, version=None):
+    for row in csv_reader:
+        if row and row[0].startswith("##"):
+            if any("v:2.1" in cell for cell in row):
+                version = "v2.1"
+                print("Detected v2.1 SAINT file.")
+            elif any("v:2.0" in cell for cell in row):
+                version = "v2.0"
+                print("Detected v2.0 SAINT file.")
+        elif row:
+            if headers is None:
+                headers = row
+                headers = sanitize_strings(headers)
+            elif version == "v2.1":
+                # For v2.1, strip exterior quotes and replace double interior quotes with single quotes
+                yield {k: v.strip('"').replace('""', '"') for k, v in zip(headers, row)}
             else:
-                print("Invalid file_type. Use 'csv' or 'saint'.")
-                return None
+                # For v2.0 or if version is not specified, keep as is
+                yield dict(zip(headers, row))
+
+
+# Raised to stop converting a file once pre-flight validation has rejected more rows than allowed
+class RowValidationError(Exception):
+    pass
+
+
+# Pre-flight checks of the rows of a lookup file, run on the raw cells as the file is converted so a bad file is caught
+# before anything is uploaded. A row is rejected if it doesn't have one cell per header, holds bytes that aren't valid in
+# the file's encoding, has an empty key (first cell), has a cell longer than max_field_length characters, or (when column
+# types are given) holds a value that isn't of its column's type. Rejected rows are left out of the conversion and written
+# with the reason to a csv at quarantine_path, if given. Once more than max_rejected_rows rows are rejected, conversion
+# stops with a RowValidationError.
+class RowValidator:
+    def __init__(self, layout, quarantine_path=None, max_field_length=DEFAULT_MAX_FIELD_LENGTH, max_rejected_rows=None, column_types=None):
+        self.layout = layout
+        self.quarantine_path = quarantine_path
+        self.max_field_length = max_field_length
+        self.max_rejected_rows = max_rejected_rows
+        self.typed_columns = [(cell_number, header, column_types[header]) for cell_number, header in enumerate(layout.headers) if (column_types or {}).get(header, "string") != "string"]
+        self.quarantine_file = None
+        self.quarantine_writer = None
+        self.checked_rows = 0
+        self.rejected_rows = 0
+        self.rejections = {}
+        self.stopped = False
+
+        # A quarantine file left by an earlier run would otherwise look like it came from this one
+        if quarantine_path and os.path.exists(quarantine_path):
+            os.remove(quarantine_path)
+
+    # Pass through the rows of a csv reader that pass every check, rejecting the rest. SAINT "##" rows and blank rows are
+    # passed through unchecked.
+    def filter_records(self, records):
+        for row in records:
+            if not row or (self.layout.file_type == "saint" and row[0].startswith("##")):
+                yield row
+                continue
+
+            self.checked_rows += 1
+            problem = self.check(row)
+            if problem is None:
+                yield row
+            else:
+                self.reject(row, problem)
+
+    # Return what's wrong with a row, or None if nothing is
+    def check(self, row):
+        header_count = len(self.layout.headers)
+        if len(row) != header_count:
+            return "wrong_width", f"expected {header_count} cells, found {len(row)}"
+        if any(INVALID_BYTES.search(cell) for cell in row):
+            return "invalid_encoding", f"holds bytes that aren't valid {self.layout.encoding}"
+
+        if self.layout.version == "v2.1":
+            row = [cell.strip('"').replace('""', '"') for cell in row]
+        if not row[0].strip():
+            return "empty_key", "the key (first cell) is empty"
+        for cell_number, cell in enumerate(row):
+            if len(cell) > self.max_field_length:
+                return "field_too_long", f"{self.layout.headers[cell_number]} is {len(cell)} characters long (the limit is {self.max_field_length})"
+        for cell_number, header, column_type in self.typed_columns:
+            if row[cell_number] and not value_matches_type(row[cell_number], column_type):
+                return "invalid_value", f"{header} value {row[cell_number][:50]!r} isn't a valid {column_type}"
+        return None
+
+    def reject(self, row, problem):
+        reason, description = problem
+        self.rejected_rows += 1
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+
+        if self.quarantine_path:
+            if self.quarantine_writer is None:
+                # Written in the file's own encoding, with undecodable bytes written back as they were
+                self.quarantine_file = open(self.quarantine_path, 'w', encoding=self.layout.encoding, errors="surrogateescape", newline="")
+                self.quarantine_writer = csv.writer(self.quarantine_file, delimiter=self.layout.delimiter)
+                self.quarantine_writer.writerow(["row_number", "rejected_reason"] + self.layout.headers)
+            self.quarantine_writer.writerow([self.checked_rows, description] + row)
+
+        if self.max_rejected_rows is not None and self.rejected_rows > self.max_rejected_rows:
+            self.stopped = True
+            raise RowValidationError(f"more than {self.max_rejected_rows} row(s) failed validation")
+
+    # Print how many rows were checked and rejected, and why
+    def report(self):
+        if not self.rejected_rows:
+            print(f"Validated {self.checked_rows} row(s). None were rejected.")
+            return
+        reasons = ", ".join(f"{reason}: {count}" for reason, count in sorted(self.rejections.items()))
+        quarantined = f" They were written to {self.quarantine_path}." if self.quarantine_path else ""
+        print(f"Validated {self.checked_rows} row(s) and rejected {self.rejected_rows} ({reasons}).{quarantined}")
+
+    def close(self):
+        if self.quarantine_file is not None:
+            self.quarantine_file.close()
+            self.quarantine_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Yield every data row of a csv or SAINT file (or of the byte range from start to end) as a dict keyed by the sanitized
+# headers, reading from the data offset found by inspect_file. With a validator, only the rows that pass its checks are
+# yielded, and bytes that aren't valid in the file's encoding are passed to it instead of stopping the read.
+def iter_rows(file_path, layout, start=None, end=None, validator=None):
+    decode_errors = "strict" if validator is None else "surrogateescape"
+    with io.TextIOWrapper(open_lookup_data(file_path, layout, start, end), encoding=layout.encoding, errors=decode_errors) as data_file:
+        csv_reader = csv.reader(data_file, delimiter=layout.delimiter)
+        records = csv_reader if validator is None else validator.filter_records(csv_reader)
+        if layout.file_type == "saint":
+            yield from iter_saint_rows(records, layout.headers, layout.version)
+        else:
+            yield from iter_csv_rows(records, layout.headers)
+
+
+# Serialize rows and write them to json_file in blocks
+def write_rows_to_json(json_file, rows, tenant_id, lookup_dataset_name):
+    encoder = JsonRowEncoder(tenant_id, lookup_dataset_name)
+    while True:
+        block = list(islice(rows, ROWS_PER_WRITE))
+        if not block:
+            break
+        json_file.write(encoder.encode_rows(block))
+
+
+# Arrow type of the values written for each column type
+def arrow_column_type(column_type):
+    import pyarrow as pa  # Optional, only needed for parquet output and the arrow engine
+    return {"integer": pa.int64(), "number": pa.float64(), "boolean": pa.bool_()}.get(column_type, pa.string())
+
+
+# Nest a block of columns under {tenant_id: {dataset_name: ...}} as a one column table
+def nest_lookup_table(columns, headers, tenant_id, lookup_dataset_name):
+    import pyarrow as pa  # Optional, only needed for parquet output and the arrow engine
+    lookup_column = pa.StructArray.from_arrays(columns, names=headers)
+    dataset_column = pa.StructArray.from_arrays([lookup_column], names=[sanitize_strings(lookup_dataset_name)])
+    return pa.Table.from_arrays([dataset_column], names=[tenant_id])
+
+
+# Write rows as parquet part files: each block of rows becomes a dictionary encoded row group nested under
+# {tenant_id: {dataset_name: ...}}. Only a row group and the part being built are held in memory.
+def write_rows_to_parquet(part_writer, rows, headers, tenant_id, lookup_dataset_name, compression="snappy", column_types=None):
+    import pyarrow as pa  # Optional, only needed for parquet output
+
+    def iter_tables():
+        while True:
+            block = list(islice(rows, ROWS_PER_ROW_GROUP))
+            if not block:
+                break
+
+            # There's a column for every header, so a short row's missing cells are null. Extra cells from over-long csv
+            # rows (collected under a None key) have no column to go in.
+            columns = [pa.array([row.get(header) for row in block], type=arrow_column_type((column_types or {}).get(header))) for header in headers]
+            yield nest_lookup_table(columns, headers, tenant_id, lookup_dataset_name)
+
+    write_tables_to_parquet(part_writer, iter_tables(), compression)
+
+
+# Write nested lookup tables as parquet part files, handing a part to part_writer once it reaches the writer's part size
+def write_tables_to_parquet(part_writer, tables, compression="snappy"):
+    import pyarrow.parquet as pq  # Optional, only needed for parquet output
+
+    part_buffer = None
+    parquet_writer = None
+
+    for table in tables:
+        if parquet_writer is None:
+            part_buffer = io.BytesIO()
+            parquet_writer = pq.ParquetWriter(part_buffer, table.schema, compression=compression, use_dictionary=True)
+        parquet_writer.write_table(table, row_group_size=ROWS_PER_ROW_GROUP)
+
+        if part_buffer.tell() >= part_writer.part_size:
+            parquet_writer.close()
+            part_writer.write_part(part_buffer.getvalue())
+            parquet_writer = None
+
+    if parquet_writer is not None:
+        parquet_writer.close()
+        part_writer.write_part(part_buffer.getvalue())
+
+
+# Write rows to part_writer in the requested output format ("json" or "parquet"), converting typed columns to native values
+def write_rows(part_writer, rows, headers, tenant_id, lookup_dataset_name, output_format="json", parquet_compression="snappy", column_types=None):
+    mismatches = {"count": 0}
+    if column_types:
+        rows = convert_row_types(rows, column_types, mismatches)
+
+    if output_format == "parquet":
+        write_rows_to_parquet(part_writer, rows, headers, tenant_id, lookup_dataset_name, parquet_compression, column_types)
+    else:
+        write_rows_to_json(part_writer, rows, tenant_id, lookup_dataset_name)
+
+    if mismatches["count"]:
+        print(f"{mismatches['count']} value(s) didn't match their column's inferred type and were left empty. Use --validate_types to infer types from every row.")
+
+
+# Feed the bytes between two byte offsets to a QuoteScanner without holding the whole range in memory
+def scan_quotes(f, scanner, start, end):
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = f.read(min(remaining, SHARD_SCAN_CHUNK_SIZE))
+        if not chunk:
+            break
+        scanner.feed(chunk)
+        remaining -= len(chunk)
+
+
+# Split the data rows of a file into byte ranges that start and end on record boundaries. A boundary is a line end that
+# isn't inside a quoted cell, by the same quoting rules the csv module reads the file with, so newlines inside quoted cells
+# are never split. Returns None if the file ends inside a quoted cell (e.g. a stray opening quote), since record boundaries
+# can't be trusted then.
+def find_shard_ranges(file_path, data_start, shard_count, delimiter):
+    file_size = os.path.getsize(file_path)
+    shard_size = max(1, (file_size - data_start) // shard_count)
+    boundaries = [data_start]
+    scanner = QuoteScanner(delimiter)
+
+    with open(file_path, 'rb') as f:
+        for shard_number in range(1, shard_count):
+            target = max(data_start + shard_number*shard_size, boundaries[-1])
+            if target >= file_size:
+                break
+            scan_quotes(f, scanner, boundaries[-1], target)
+            f.seek(target)
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                scanner.feed(line)
+                if not scanner.in_quoted_cell():
+                    break
+            boundary = f.tell()
+            if boundary >= file_size:
+                break
+            boundaries.append(boundary)
+
+        scan_quotes(f, scanner, boundaries[-1], file_size)
+
+    if scanner.in_quoted_cell():
+        return None
+
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+# Read only the bytes between start and end of a file
+class FileRangeReader(io.RawIOBase):
+    def __init__(self, file_path, start, end):
+        self.file = open(file_path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        data = self.file.read(size)
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+# Read the data rows of a binary csv or SAINT stream (positioned after the header row) in blocks with pyarrow's csv reader,
+# yielding record batches of string columns named by the sanitized headers. SAINT v2.1 unquoting runs as column operations.
+# Rows with the wrong number of cells are parsed again with the csv module: missing cells are null and extra cells are dropped.
+# They're yielded after the rest of their block, so rows don't always come out in file order.
+def iter_arrow_blocks(stream, layout):
+    import pyarrow as pa  # Optional, only needed for the arrow engine
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+
+    headers = layout.headers
+    delimiter = layout.delimiter
+    schema = pa.schema([(header, pa.string()) for header in headers])
+    ragged_rows = []
+
+    def collect_ragged_row(row):
+        cells = next(csv.reader([row.text], delimiter=delimiter), [])
+        ragged_rows.append(dict(zip(headers, cells)))
+        return 'skip'
+
+    reader = pa_csv.open_csv(
+        stream,
+        read_options=pa_csv.ReadOptions(column_names=headers, encoding=layout.encoding, block_size=ARROW_BLOCK_SIZE),
+        parse_options=pa_csv.ParseOptions(delimiter=delimiter, newlines_in_values=True, invalid_row_handler=collect_ragged_row),
+        convert_options=pa_csv.ConvertOptions(column_types=schema, strings_can_be_null=False, quoted_strings_can_be_null=False),
+    )
+
+    def unquote(block):
+        if layout.version != "v2.1":
+            return block
+        # For v2.1, strip exterior quotes and replace double interior quotes with single quotes
+        columns = [pc.replace_substring(pc.utf8_trim(column, '"'), '""', '"') for column in block.columns]
+        return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    for block in reader:
+        if block.num_rows:
+            yield unquote(block)
+        if ragged_rows:
+            yield unquote(pa.RecordBatch.from_pylist(ragged_rows, schema=schema))
+            ragged_rows.clear()
+
+
+# Read every data row of a csv or SAINT file (or of the byte range from start to end) in blocks with the arrow engine
+def iter_file_blocks(file_path, layout, start=None, end=None):
+    with open_lookup_data(file_path, layout, start, end) as data_file:
+        yield from iter_arrow_blocks(data_file, layout)
+
+
+# Convert a string column to native values of its column type, with empty cells as nulls. Whole columns are cast at once;
+# a column holding a value that doesn't parse (possible when types were inferred from a sample) is converted value by value
+# instead, writing nulls for the bad values and counting them in mismatches["count"].
+def convert_column_type(column, column_type, mismatches):
+    import pyarrow as pa  # Optional, only needed for the arrow engine
+    import pyarrow.compute as pc
+
+    column = pc.if_else(pc.equal(column, ""), pa.scalar(None, pa.string()), column)
+    try:
+        if column_type == "boolean":
+            lowered = pc.utf8_lower(column)
+            if not pc.all(pc.or_kleene(pc.is_null(column), pc.is_in(lowered, value_set=pa.array(["true", "false"])))).as_py():
+                raise ValueError(column_type)
+            return pc.equal(lowered, "true")
+        # Casts accept values the type's pattern rejects (like 007, nan or inf), so the values are matched against it first
+        pattern = f"^(?:{TYPE_PATTERNS[column_type].pattern})$"
+        if not pc.all(pc.or_kleene(pc.is_null(column), pc.match_substring_regex(column, pattern))).as_py():
+            raise ValueError(column_type)
+        values = pc.cast(column, arrow_column_type(column_type))
+        if column_type == "number" and not pc.all(pc.or_kleene(pc.is_null(values), pc.is_finite(values))).as_py():
+            raise ValueError(column_type)
+        return values
+    except (pa.ArrowInvalid, ValueError):
+        pass
+
+    converter = TYPE_CONVERTERS[column_type]
+    values = []
+    for value in column.to_pylist():
+        if value is not None:
+            try:
+                value = converter(value)
+            except ValueError:
+                value = None
+                mismatches["count"] += 1
+        values.append(value)
+    return pa.array(values, type=arrow_column_type(column_type))
+
+
+# Convert each typed column of a block of rows to native values
+def convert_block_types(block, column_types, mismatches):
+    import pyarrow as pa  # Optional, only needed for the arrow engine
+
+    columns = []
+    for header, column in zip(block.schema.names, block.columns):
+        if column_types.get(header) in TYPE_CONVERTERS:
+            column = convert_column_type(column, column_types[header], mismatches)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, names=block.schema.names)
+
+
+# Write blocks of rows from the arrow engine to part_writer in the requested output format. Parquet output writes the blocks
+# as they are; json output serializes each block at once.
+def write_blocks(part_writer, blocks, tenant_id, lookup_dataset_name, output_format="json", parquet_compression="snappy", column_types=None):
+    import pyarrow as pa  # Optional, only needed for the arrow engine
+
+    mismatches = {"count": 0}
+    if column_types:
+        blocks = (convert_block_types(block, column_types, mismatches) for block in blocks)
+
+    if output_format == "parquet":
+        def iter_tables():
+            # Gather blocks into row groups of about ROWS_PER_ROW_GROUP rows
+            pending = []
+            pending_rows = 0
+            for block in blocks:
+                pending.append(block)
+                pending_rows += block.num_rows
+                if pending_rows >= ROWS_PER_ROW_GROUP:
+                    yield pa.Table.from_batches(pending)
+                    pending = []
+                    pending_rows = 0
+            if pending:
+                yield pa.Table.from_batches(pending)
+
+        tables = (nest_lookup_table([column.combine_chunks() for column in table.columns], table.column_names, tenant_id, lookup_dataset_name) for table in iter_tables())
+        write_tables_to_parquet(part_writer, tables, parquet_compression)
+    else:
+        encoder = JsonRowEncoder(tenant_id, lookup_dataset_name)
+        for block in blocks:
+            part_writer.write(encoder.encode_block(block))
+
+    if mismatches["count"]:
+        print(f"{mismatches['count']} value(s) didn't match their column's inferred type and were left empty. Use --validate_types to infer types from every row.")
+
+
+# Yield every data row of a file (or of the byte range from start to end) as a dict with the chosen engine, in the order
+# the engine converts them. Rows checked by a validator are always read with the python engine, which sees the raw cells.
+def iter_file_rows(file_path, layout, engine="python", start=None, end=None, validator=None):
+    if validator is not None:
+        return iter_rows(file_path, layout, start, end, validator)
+    if engine == "arrow":
+        return (row for block in iter_file_blocks(file_path, layout, start, end) for row in block.to_pylist())
+    return iter_rows(file_path, layout, start, end)
+
+
+# Pass rows through, adding how many went past to counts["rows"] once they've all been read
+def count_rows(rows, counts):
+    row_count = 0
+    for row_count, row in enumerate(rows, 1):
+        yield row
+    counts["rows"] = counts.get("rows", 0) + row_count
+
+
+# Pass pyarrow record batches through, adding how many rows they held to counts["rows"] once they've all been read
+def count_block_rows(blocks, counts):
+    row_count = 0
+    for block in blocks:
+        row_count += block.num_rows
+        yield block
+    counts["rows"] = counts.get("rows", 0) + row_count
+
+
+# Convert the data rows of a file (or of the byte range from start to end) into part_writer with the chosen engine:
+# "python" reads rows with the csv module, "arrow" reads blocks of rows with pyarrow.
+# row_filter, if given, is applied to the stream of row dicts. The number of rows written is added to counts["rows"].
+# validator, if given, leaves out the rows that fail its pre-flight checks.
+def convert_rows(part_writer, file_path, layout, tenant_id, lookup_dataset_name, row_filter=None, output_format="json", parquet_compression="snappy", column_types=None, engine="python", start=None, end=None, counts=None, validator=None):
+    counts = {} if counts is None else counts
+    if engine == "arrow" and row_filter is None and validator is None:
+        blocks = count_block_rows(iter_file_blocks(file_path, layout, start, end), counts)
+        write_blocks(part_writer, blocks, tenant_id, lookup_dataset_name, output_format, parquet_compression, column_types)
+        return
+
+    rows = iter_file_rows(file_path, layout, engine, start, end, validator)
+    if row_filter is not None:
+        rows = row_filter(rows)
+    write_rows(part_writer, count_rows(rows, counts), layout.headers, tenant_id, lookup_dataset_name, output_format, parquet_compression, column_types)
+
+
+# Convert one byte range of a file into part files (runs in a worker process) and return the part file paths and the
+# number of rows converted
+def convert_shard(file_path, layout, start, end, tenant_id, lookup_dataset_name, json_base_path, part_size, output_format="json", parquet_compression="snappy", column_types=None, engine="python"):
+    counts = {}
+    with JsonPartWriter(json_base_path, part_size, f".{output_format}") as json_file:
+        convert_rows(json_file, file_path, layout, tenant_id, lookup_dataset_name, None, output_format, parquet_compression, column_types, engine, start, end, counts)
+
+    return json_file.part_paths, counts.get("rows", 0)
+
+
+# Convert a file across a pool of worker processes, one byte range per worker, and return the part file paths in file order.
+# Returns None if the file can't be split safely so the caller can fall back to a single process.
+# The number of rows converted is added to counts["rows"].
+def csv_to_json_sharded(file_path, tenant_id, lookup_dataset_name, layout, json_base_path, part_size, workers, output_format="json", parquet_compression="snappy", column_types=None, engine="python", counts=None):
+    shard_ranges = find_shard_ranges(file_path, layout.data_start, workers, layout.delimiter)
+    if shard_ranges is None:
+        print("An unclosed quoted cell was found, so the file can't be split safely. Converting with a single process instead.")
+        return None
+
+    print(f"Converting {len(shard_ranges)} shard(s) using {workers} worker process(es)...")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(convert_shard, file_path, layout, start, end, tenant_id, lookup_dataset_name, f"{json_base_path}_shard{shard_number:03d}", part_size, output_format, parquet_compression, column_types, engine)
+            for shard_number, (start, end) in enumerate(shard_ranges)
+        ]
+        shard_results = []
+        failure = None
+        for future in futures:
+            try:
+                shard_results.append(future.result())
+            except Exception as e:
+                failure = failure or e
+
+    # A failed shard deletes its own part files, so only the parts of the shards that finished are left to delete
+    if failure is not None:
+        remove_part_files([part_path for part_paths, _ in shard_results for part_path in part_paths])
+        raise failure
+
+    if counts is not None:
+        counts["rows"] = counts.get("rows", 0) + sum(row_count for _, row_count in shard_results)
+    return [part_path for part_paths, _ in shard_results for part_path in part_paths]
+
+
+# Path the part files of a lookup file are named from: next to the file (or the compressed file or zip archive holding it)
+# and named after its whole name with the dots made underscores (campaigns_tab for campaigns.tab, exports_zip_campaigns_tab
+# for exports.zip/campaigns.tab), so two lookup files in one folder never write over each other's parts. Standard input's
+# parts go in the temp folder. They go in work_folder instead, if given.
+def part_file_base_path(file_path, work_folder=None):
+    if file_path == STDIN_PATH:
+        return os.path.join(work_folder or tempfile.gettempdir(), f"stdin_{os.getpid()}")
+    zip_path, member_name = split_zip_path(file_path)
+    source_name = os.path.basename(zip_path or file_path)
+    if member_name:
+        source_name = f"{source_name}/{member_name}"
+    return os.path.join(work_folder or os.path.dirname(zip_path or file_path), re.sub(r'[./\\]', '_', source_name))
+
+
+# Convert a csv or SAINT file into json (or parquet) part files and return the list of paths to the part files
+# row_filter, if given, is applied to the stream of row dicts (which rules out converting with several worker processes)
+# The number of rows converted and the bytes written are added to counts["rows"] and counts["bytes"].
+# validator, if given, checks every row before it's converted (in a single process, so it sees every row).
+# The part files are written to work_folder, if given, instead of next to the file.
+def csv_to_json(file_path, tenant_id, lookup_dataset_name, layout, part_size=DEFAULT_PART_SIZE_MB*1024*1024, workers=1, row_filter=None, output_format="json", parquet_compression="snappy", column_types=None, engine="python", counts=None, validator=None, work_folder=None):
+    counts = {} if counts is None else counts
+    json_base_path = part_file_base_path(file_path, work_folder)
+    
+    if layout.file_type not in ("csv", "saint"):
+        print("Invalid file_type. Use 'csv' or 'saint'.")
+        return None
+
+    if workers > 1 and is_streamed_source(file_path):
+        print("Compressed files and standard input are read as a stream, so they're converted with a single process.")
+        workers = 1
+
+    try:
+        if workers > 1 and row_filter is None and validator is None:
+            json_file_paths = csv_to_json_sharded(file_path, tenant_id, lookup_dataset_name, layout, json_base_path, part_size, workers, output_format, parquet_compression, column_types, engine, counts)
+            if json_file_paths is not None:
+                counts["bytes"] = counts.get("bytes", 0) + sum(os.path.getsize(path) for path in json_file_paths)
+                return json_file_paths
+
+        with JsonPartWriter(json_base_path, part_size, f".{output_format}") as json_file:
+            convert_rows(json_file, file_path, layout, tenant_id, lookup_dataset_name, row_filter, output_format, parquet_compression, column_types, engine, counts=counts, validator=validator)
     
     except FileNotFoundError:
         print(f"File {file_path} not found.")
@@ -200,113 +1658,287 @@ def csv_to_json(file_path, tenant_id, lookup_dataset_name, file_type):
         print(f"An error occurred: {e}")
         return None
     
-    return json_file_path
+    counts["bytes"] = counts.get("bytes", 0) + sum(os.path.getsize(path) for path in json_file.part_paths)
+    return json_file.part_paths
 
 
-def write_to_json(json_file, row, tenant_id, lookup_dataset_name):
-    # Assuming sanitize_strings is a function you've defined to sanitize strings
-    sanitized_lookup_name = sanitize_strings(lookup_dataset_name)
-    
-    # Nest the row under the tenant ID and lookup dataset name (to avoid collisions)
-    nested_row = {
-        tenant_id: {
-            sanitized_lookup_name: row
-        }
-    }
-    
-    # Write the nested row as a single line in the JSON file
-    json_file.write(json.dumps(nested_row) + '\n')
+# Convert a csv or SAINT file straight into uploaded batch parts, overlapping conversion with upload and never writing a temp file
+# The number of rows converted and the bytes uploaded are added to counts["rows"] and counts["bytes"].
+# validator, if given, checks every row before it's converted. Parts are uploaded through client, a LookupClient.
+def csv_to_batch(client, file_path, tenant_id, lookup_dataset_name, layout, batch_id, dataset_id, part_size=DEFAULT_PART_SIZE_MB*1024*1024, upload_workers=DEFAULT_UPLOAD_WORKERS, row_filter=None, compression=None, compression_level=None, output_format="json", parquet_compression="snappy", column_types=None, engine="python", journal=None, counts=None, validator=None):
+    counts = {} if counts is None else counts
+    print(f"Converting and uploading json to dataset using {upload_workers} upload worker(s)...")
+    upload_start = time.time()
 
+    if layout.file_type not in ("csv", "saint"):
+        print("Invalid file_type. Use 'csv' or 'saint'.")
+        return None
 
+    try:
+        with PipelinedPartUploader(client, batch_id, dataset_id, part_size, upload_workers, compression, compression_level, output_format, journal) as uploader:
+            convert_rows(uploader, file_path, layout, tenant_id, lookup_dataset_name, row_filter, output_format, parquet_compression, column_types, engine, counts=counts, validator=validator)
+            uploaded = uploader.close()
+            counts["bytes"] = counts.get("bytes", 0) + uploader.uploaded_bytes
 
-# Fetch AEP schema class list searching for whatever is specified as the standard schema class name
-def fetch_schema_class(standard_schema_class_name):
-    headers = {
-        "Content-Type": "application/json",
-        "x-gw-ims-org-id": org_id,
-        "x-sandbox-name": sandbox,
-        "Authorization": f"Bearer {access_token}",
-        "x-api-key": api_key,
-        "Accept": "application/vnd.adobe.xed-id+json"
-    }
-    
-    response = requests.get(
-        f"https://platform.adobe.io/data/foundation/schemaregistry/tenant/classes?limit=1&property=title=={standard_schema_class_name}",
-        headers=headers
-    )
+    except FileNotFoundError:
+        print(f"File {file_path} not found.")
+        return None
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
 
-    try:
-        json_response = json.loads(response.text)
-        results = json_response.get("results", [])
-        
-        if results: # if this schema class already exists (the array is not empty)
-            schema_class_id = results[0].get("$id", None)
-            print(f"Existing schema class found: {schema_class_id}")
-            return schema_class_id  # Return the schema ID
-        else:  # If results array is empty
-            print("No existing lookup schema class found. Proceeding to create one...")
-            return None  # Return None to indicate that no results were found
-
-    except json.JSONDecodeError:
-        return f"Failed to decode JSON. Raw response: {response.text}"
-
-# Create Generic CJA Schema Class (used if it doesn't already exist)
-def create_schema_class(standard_schema_class_name):
-    headers = {
-        "Content-Type": "application/json",
-        "x-gw-ims-org-id": org_id,
-        "x-sandbox-name": sandbox,
-        "Authorization": f"Bearer {access_token}",
-        "x-api-key": api_key,
-        "Accept": "application/vnd.adobe.xed-id+json"
-    }
-    
-    payload = {
-        "title": standard_schema_class_name,
-        "description": "A generic lookup class for creating schemas for lookup datasets for CJA.",
-        "imsOrg": org_id,
-        "type": "object",
-        "allOf": [
-            {
-                "$ref": "https://ns.adobe.com/xdm/data/record",
-            }
-        ]
-    }
+    if uploaded:
+        print(f"Successfully loaded {uploader.part_count} json part(s) to batch {batch_id} in {time.time() - upload_start:.1f}s.")
+        return True
+    else:
+        print("Failed to upload one or more json parts to batch.")
+        return None  # Return None to indicate failure
 
-    response = requests.post(
-        "https://platform.adobe.io/data/foundation/schemaregistry/tenant/classes",
-        headers = headers,
-        json = payload
-    )
 
-    try:
-        json_response = json.loads(response.text)
-        if response.status_code == 201:
-            schema_class_id = json_response.get('$id', None)
-            print(f"Created schema class ID: {schema_class_id}")
-            return schema_class_id  # Return the schema class ID
+# Index of key column value hash -> row number used to drop rows whose key appeared elsewhere in the file. Keys are kept
+# as 16 byte hashes in memory until there are more than max_memory_keys of them, then the index moves to a temporary
+# sqlite file so huge files don't run out of memory.
+# policy "first" keeps the first row for each key as the rows stream past. policy "last" keeps the last one, so the rows
+# are passed through scan first to find where each key last appears.
+class DuplicateKeyIndex:
+    def __init__(self, policy, max_memory_keys=DEFAULT_DEDUPE_MEMORY_KEYS):
+        self.policy = policy
+        self.max_memory_keys = max_memory_keys
+        self.keys = {}
+        self.connection = None
+        self.spill_path = None
+        self.dropped_rows = 0
+
+    # Move the in-memory keys to a temporary sqlite file
+    def spill(self):
+        file_descriptor, self.spill_path = tempfile.mkstemp(prefix="lookup_creator_keys_", suffix=".sqlite")
+        os.close(file_descriptor)
+        print(f"More than {self.max_memory_keys} distinct keys, moving the duplicate key index to {self.spill_path}...")
+        self.connection = sqlite3.connect(self.spill_path)
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute("CREATE TABLE keys (key_hash BLOB PRIMARY KEY, row_number INTEGER NOT NULL)")
+        self.connection.executemany("INSERT INTO keys VALUES (?, ?)", self.keys.items())
+        self.keys = {}
+
+    # Record that a key appears at row_number, returning the row number recorded for it first
+    def record_first(self, key_hash, row_number):
+        if self.connection is None:
+            first_row_number = self.keys.setdefault(key_hash, row_number)
+            if len(self.keys) > self.max_memory_keys:
+                self.spill()
+            return first_row_number
+        cursor = self.connection.execute("INSERT OR IGNORE INTO keys VALUES (?, ?)", (key_hash, row_number))
+        if cursor.rowcount:
+            return row_number
+        return self.connection.execute("SELECT row_number FROM keys WHERE key_hash = ?", (key_hash,)).fetchone()[0]
+
+    # Record that a key appears at row_number, replacing any earlier row number
+    def record_last(self, key_hash, row_number):
+        if self.connection is None:
+            self.keys[key_hash] = row_number
+            if len(self.keys) > self.max_memory_keys:
+                self.spill()
         else:
-            print(f"Failed to create schema class. Status code: {response.status_code}, Details: {json_response}")
-            return None  # Return None to indicate failure
-    except json.JSONDecodeError:
-        print(f"Failed to decode JSON. Raw response: {response.text}")
-        return None  # Return None to indicate an error
-
-# Create a field group to create a schema
-def create_field_group(schema_class_id, tenant_id, csv_headers, lookup_dataset_name):
-    headers = {
-        "Content-Type": "application/json",
-        "x-gw-ims-org-id": org_id,
-        "x-sandbox-name": sandbox,
-        "Authorization": f"Bearer {access_token}",
-        "x-api-key": api_key,
-        "Accept": "application/vnd.adobe.xed-id+json"
-    }
-    
+            self.connection.execute("INSERT OR REPLACE INTO keys VALUES (?, ?)", (key_hash, row_number))
+
+    def lookup(self, key_hash):
+        if self.connection is None:
+            return self.keys.get(key_hash)
+        return self.connection.execute("SELECT row_number FROM keys WHERE key_hash = ?", (key_hash,)).fetchone()[0]
+
+    # Find where each key last appears (only needed for the "last" policy)
+    def scan(self, rows):
+        for row_number, row in enumerate(rows):
+            self.record_last(key_hash(row), row_number)
+
+    # Yield only the row kept for each key, keyed on the first column. Rows must come in the same order as they were scanned.
+    def filter_duplicate_rows(self, rows):
+        for row_number, row in enumerate(rows):
+            if self.policy == "last":
+                kept_row_number = self.lookup(key_hash(row))
+            else:
+                kept_row_number = self.record_first(key_hash(row), row_number)
+            if kept_row_number != row_number:
+                self.dropped_rows += 1
+                continue
+            yield row
+
+    def close(self):
+        self.keys = {}
+        if self.connection is not None:
+            self.connection.close()
+            os.remove(self.spill_path)
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Chain row filters so each one filters the rows the one before it let through (None filters are skipped)
+def compose_row_filters(*row_filters):
+    row_filters = [row_filter for row_filter in row_filters if row_filter is not None]
+
+    def filter_rows(rows):
+        for row_filter in row_filters:
+            rows = row_filter(rows)
+        return rows
+    return filter_rows
+
+
+# Hash of a row's key (its first column) for the duplicate key index
+def key_hash(row):
+    key = next(iter(row.values()), None)
+    return hashlib.blake2b((key or "").encode('utf-8'), digest_size=16).digest()
+
+
+# Local index of key column value -> row hash from the last load of a dataset, used to upload only inserted and changed
+# rows on a refresh. Fingerprints from a run are staged and only merged into the index once that run's batch is uploaded,
+# so a failed refresh never hides its rows from the next one.
+class FingerprintIndex:
+    def __init__(self, index_path):
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fingerprints (key TEXT PRIMARY KEY, row_hash BLOB NOT NULL)")
+        self.connection.execute("CREATE TEMP TABLE pending (key TEXT PRIMARY KEY, row_hash BLOB NOT NULL)")
+        self.inserted_rows = 0
+        self.changed_rows = 0
+        self.unchanged_rows = 0
+
+    # Yield only the rows whose key is new or whose contents changed since the last load, keyed on the first column
+    def filter_changed_rows(self, rows):
+        cursor = self.connection.cursor()
+        pending = []
+        for row in rows:
+            key = next(iter(row.values()), None)
+            row_hash = hashlib.blake2b(json.dumps(row).encode('utf-8'), digest_size=16).digest()
+            existing = cursor.execute("SELECT row_hash FROM fingerprints WHERE key = ?", (key,)).fetchone()
+            if existing is None:
+                self.inserted_rows += 1
+            elif existing[0] == row_hash:
+                self.unchanged_rows += 1
+                continue
+            else:
+                self.changed_rows += 1
+
+            pending.append((key, row_hash))
+            if len(pending) >= FINGERPRINT_WRITE_ROWS:
+                cursor.executemany("INSERT OR REPLACE INTO pending VALUES (?, ?)", pending)
+                pending = []
+            yield row
+
+        cursor.executemany("INSERT OR REPLACE INTO pending VALUES (?, ?)", pending)
+
+    # Keep this run's fingerprints once its batch has been uploaded
+    def commit(self):
+        self.connection.execute("INSERT OR REPLACE INTO fingerprints SELECT key, row_hash FROM pending")
+        self.connection.execute("DELETE FROM pending")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Where the fingerprint index for a dataset is kept unless one is given
+def default_fingerprint_path(org_id, sandbox, dataset_id):
+    return os.path.join(DEFAULT_FINGERPRINT_FOLDER, f"{sanitize_strings(org_id)}_{sanitize_strings(sandbox)}_{dataset_id}.sqlite")
+
+
+# Journal of the steps a load has finished (column types, created IDs, converted part files, the open batch and the
+# checksum of every uploaded part) so a --resume run can pick up where a failed one stopped. The journal belongs to one
+# run identity (input file, its size and modification time, and the settings that change the uploaded data), and a
+# journal written for a different identity is never resumed. It is deleted once the load succeeds.
+class CheckpointJournal:
+    def __init__(self, journal_path, run_identity):
+        self.journal_path = journal_path
+        self.run_identity = run_identity
+        self.lock = threading.Lock()
+        self.steps = {}
+
+    # Read the journal left by an earlier run, returning its steps (whatever run it belongs to) or None if there isn't one
+    def read(self):
+        try:
+            with open(self.journal_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    # Pick up the steps of an earlier run of the same load, returning whether there were any
+    def resume(self):
+        journal = self.read()
+        if journal is None or journal.get("run") != self.run_identity:
+            return False
+        self.steps = journal.get("steps", {})
+        return True
+
+    def get(self, step, default=None):
+        return self.steps.get(step, default)
+
+    def record(self, step, value):
+        with self.lock:
+            self.steps[step] = value
+            self.save()
+
+    # Checksum recorded for an uploaded part, or None if it wasn't uploaded
+    def uploaded_checksum(self, part_number):
+        return self.steps.get("uploaded_parts", {}).get(str(part_number))
+
+    def record_upload(self, part_number, checksum):
+        with self.lock:
+            self.steps.setdefault("uploaded_parts", {})[str(part_number)] = checksum
+            self.save()
+
+    def save(self):
+        # Write atomically so a run killed mid-write never leaves a half written journal
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        temp_path = f"{self.journal_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"run": self.run_identity, "steps": self.steps}, f)
+        os.replace(temp_path, self.journal_path)
+
+    def discard(self):
+        self.steps = {}
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+# Where the checkpoint journal for loading a lookup file into a dataset is kept, with a hash of the file's path so loads of
+# different files into datasets of the same name never share a journal
+def default_checkpoint_path(org_id, sandbox, lookup_dataset_name, file_path):
+    source_path = file_path if file_path == STDIN_PATH else os.path.abspath(file_path)
+    source_hash = hashlib.sha1(source_path.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(DEFAULT_CHECKPOINT_FOLDER, f"{sanitize_strings(org_id)}_{sanitize_strings(sandbox)}_{sanitize_strings(lookup_dataset_name)}_{source_hash}.json")
+
+
+# Checksum of a part's data (bytes or a file path), recorded in the checkpoint journal once the part is uploaded
+def part_checksum(part_data):
+    checksum = hashlib.blake2b(digest_size=16)
+    if isinstance(part_data, (bytes, bytearray)):
+        checksum.update(part_data)
+    else:
+        with open(part_data, 'rb') as f:
+            for chunk in iter(lambda: f.read(COMPRESSION_CHUNK_SIZE), b""):
+                checksum.update(chunk)
+    return checksum.hexdigest()
+
+# Build the field group definition for a lookup's sanitized csv headers, typed by column_types (strings if not given)
+def build_field_group_payload(schema_class_id, tenant_id, csv_headers, lookup_dataset_name, column_types=None):
     dynamic_properties = {}
     for header in csv_headers:
         dynamic_properties[header] = {
-            "type": "string",
+            **XDM_FIELD_TYPES[(column_types or {}).get(header, "string")],
             "title": f"{header}"
         }
 
@@ -336,37 +1968,15 @@ def create_field_group(schema_class_id, tenant_id, csv_headers, lookup_dataset_n
             }
         ]
     }
+    return payload
 
-    response = requests.post(
-        "https://platform.adobe.io/data/foundation/schemaregistry/tenant/fieldgroups",
-        headers = headers,
-        json = payload
-    )
-    
-    try:
-        json_response = json.loads(response.text)
-        if response.status_code == 201:
-            field_group_id = json_response.get('$id', None)
-            print(f"Created field group ID: {field_group_id}")
-            return field_group_id  # Return the field_group_id
-        else:
-            print(f"Failed to create field group. Status code: {response.status_code}, Details: {json_response}")
-            return None  # Return None to indicate failure
-    except json.JSONDecodeError:
-        print(f"Failed to decode JSON. Raw response: {response.text}")
-        return None  # Return None to indicate an error
-
-# Create a schema using the generic schema class and field group created above
-def create_schema(schema_class_id, field_group_id, lookup_dataset_name):
-    headers = {
-        "Content-Type": "application/json",
-        "x-gw-ims-org-id": org_id,
-        "x-sandbox-name": sandbox,
-        "Authorization": f"Bearer {access_token}",
-        "x-api-key": api_key,
-        "Accept": "application/vnd.adobe.xed-id+json"
-    }
-    
+# Read the lookup fields (name -> type and format) out of a field group definition
+def field_group_fields(field_group, tenant_id, lookup_dataset_name):
+    lookup_node = field_group.get("definitions", {}).get("customFields", {}).get("properties", {}).get(tenant_id, {}).get("properties", {}).get(sanitize_strings(lookup_dataset_name), {})
+    return {name: (field.get("type"), field.get("format")) for name, field in lookup_node.get("properties", {}).items()}
+
+# Build the schema definition combining the generic schema class and a lookup's field group
+def build_schema_payload(schema_class_id, field_group_id, lookup_dataset_name):
     payload = {
         "title": f"{lookup_dataset_name} schema",
         "description": "A lookup schema created programatically for CJA.",
@@ -380,253 +1990,1501 @@ def create_schema(schema_class_id, field_group_id, lookup_dataset_name):
             }
         ]
     }
+    return payload
+
+# Compress a json part (an open file, read in chunks, or bytes) with gzip or zstd. This runs in the upload worker threads;
+# zlib and zstandard release the GIL while compressing, so parts compress in parallel with conversion and other uploads.
+def compress_part(part_data, compression, compression_level=None):
+    if compression == "gzip":
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        compressor = zlib.compressobj(DEFAULT_COMPRESSION_LEVELS["gzip"] if compression_level is None else compression_level, zlib.DEFLATED, 31)
+    elif compression == "zstd":
+        import zstandard  # Optional, only needed for zstd compression
+        compressor = zstandard.ZstdCompressor(level=DEFAULT_COMPRESSION_LEVELS["zstd"] if compression_level is None else compression_level).compressobj()
+    else:
+        raise ValueError(f"Unsupported compression: {compression}")
 
-    response = requests.post(
-        "https://platform.adobe.io/data/foundation/schemaregistry/tenant/schemas",
-        headers = headers,
-        json = payload
-    )
-    
-    try:
-        json_response = json.loads(response.text)
-        if response.status_code == 201:
-            schema_id = json_response.get('$id', None)
-            print(f"Created schema ID: {schema_id}")
-            return schema_id  # Return the schema_id
-        else:
-            print(f"Failed to create schema. Status code: {response.status_code}, Details: {json_response}")
-            return None  # Return None to indicate failure
-    except json.JSONDecodeError:
-        print(f"Failed to decode JSON. Raw response: {response.text}")
-        return None  # Return None to indicate an error
-
-# Create a dataset using the schema created above
-def create_dataset(schema_id, lookup_dataset_name):
-    headers = {
-        "Content-Type": "application/json",
-        "x-gw-ims-org-id": org_id,
-        "x-sandbox-name": sandbox,
-        "Authorization": f"Bearer {access_token}",
-        "x-api-key": api_key,
-        "Accept": "application/vnd.adobe.xed-id+json"
-    }
-    
-    payload = {
-        "name": lookup_dataset_name,
-        "description": "A dataset created programatically for CJA.",
-        "schemaRef": {
-            "id": schema_id,
-            "contentType": "application/vnd.adobe.xed+json;version=1"
+    compressed_chunks = []
+    if isinstance(part_data, (bytes, bytearray)):
+        compressed_chunks.append(compressor.compress(part_data))
+    else:
+        for chunk in iter(lambda: part_data.read(COMPRESSION_CHUNK_SIZE), b""):
+            compressed_chunks.append(compressor.compress(chunk))
+    compressed_chunks.append(compressor.flush())
+    return b"".join(compressed_chunks)
+
+# Describe a part's size for progress messages, including the compressed size when it was compressed
+def describe_part_size(raw_bytes, uploaded_bytes):
+    if uploaded_bytes == raw_bytes:
+        return f"{raw_bytes / (1024*1024):.1f} MB"
+    return f"{raw_bytes / (1024*1024):.1f} MB, {uploaded_bytes / (1024*1024):.1f} MB compressed"
+
+# Client for one org's sandbox in the Platform API, holding its credentials, access token and pooled HTTP session, so loads
+# for several orgs or sandboxes can run side by side in one process. Each step of a load (authentication, schema class,
+# field group, schema, dataset and batch calls) is a method, and load_lookup runs them all end to end.
+# The access token is fetched, and the schema class looked up, when first needed and reused by every load after that.
+# Calls are paced by rate_limits, a PlatformRateLimits, if given.
+class LookupClient:
+    def __init__(self, api_key, client_secret, org_id, technical_account_id, sandbox, private_key, platform_url=DEFAULT_PLATFORM_API_URL, ims_url=DEFAULT_IMS_URL, cache=None, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, pool_size=DEFAULT_UPLOAD_WORKERS, rate_limits=None):
+        self.api_key = api_key
+        self.client_secret = client_secret
+        self.org_id = org_id
+        self.technical_account_id = technical_account_id
+        self.sandbox = sandbox
+        self.private_key = private_key
+        # Base URLs of the Platform API and of IMS, which issues access tokens; both can be pointed at a stand-in server
+        self.platform_api_url = platform_url.rstrip("/")
+        self.ims_url = ims_url.rstrip("/")
+        # LookupCache of access tokens and schema class lookups shared between runs, or None to always fetch them
+        self.cache = cache
+        self.session = PlatformSession(timeout, max_retries, pool_size, rate_limits)
+        # Fetch a new access token when a call comes back 401 Unauthorized
+        self.session.refresh_credentials = self.refresh_access_token
+        self.access_token = None
+        self.access_token_expires_at = 0
+        self.schema_class_id = None
+        self.tenant_id = None
+        self.lock = threading.Lock()
+
+    # Cache keys: access tokens belong to a technical account, schema classes and tenant IDs to an org's sandbox
+    def token_cache_key(self):
+        return f"access_token:{self.org_id}:{self.technical_account_id}"
+
+    def schema_class_cache_key(self, standard_schema_class_name):
+        return f"schema_class:{self.org_id}:{self.sandbox}:{standard_schema_class_name}"
+
+    # Generate Access Token, reusing a cached one while it's still valid
+    def get_access_token(self):
+        if self.cache is not None:
+            cached_token = self.cache.get(self.token_cache_key())
+            if cached_token:
+                print("Using cached access token.")
+                self.access_token_expires_at = self.cache.expires_at(self.token_cache_key())
+                return cached_token
+
+        import jwt  # Only needed to sign a new token request, so embedding the client doesn't pay for it up front
+        from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+        expiration = int(time.time()) + 24*60*60
+        claim = {
+            "exp": expiration,
+            "iss": self.org_id,
+            "sub": self.technical_account_id,
+            "https://ims-na1.adobelogin.com/s/ent_dataservices_sdk": True,
+            "https://ims-na1.adobelogin.com/s/ent_cja_sdk": True,
+            "aud": f"https://ims-na1.adobelogin.com/c/{self.api_key}"
         }
-    }
-
-    response = requests.post(
-        "https://platform.adobe.io/data/foundation/catalog/dataSets?requestDataSource=true",
-        headers = headers,
-        json = payload
-    )
-    
-    try:
-        json_response = json.loads(response.text)
-        if response.status_code == 201:
-            # Assuming the response is a list and we want the first item
-            dataset_path = json_response[0] if json_response else None
-            
-            # Extract the alphanumeric code after "dataSets/"
-            dataset_id = dataset_path.split("/dataSets/")[-1] if dataset_path else None
+        jwt_token = jwt.encode(claim, self.private_key, algorithm='RS256')
+        
+        payload = MultipartEncoder({
+            "client_id": self.api_key,
+            "client_secret": self.client_secret,
+            "jwt_token": jwt_token
+        })
+        
+        # Authorization is dropped from the session's headers since we're fetching a new token
+        response = self.session.post(
+            f"{self.ims_url}/ims/exchange/jwt",
+            headers={"Content-Type": payload.content_type, "Authorization": None},
+            data=payload
+        )
+        token_response = json.loads(response.text)
+        access_token = token_response['access_token']
+
+        # IMS reports expires_in in milliseconds; stop using the token a little early so it can't expire mid-run
+        ttl_seconds = token_response.get('expires_in', 24*60*60*1000) / 1000 - TOKEN_EXPIRY_MARGIN_SECONDS
+        self.access_token_expires_at = time.time() + ttl_seconds
+        if self.cache is not None:
+            self.cache.set(self.token_cache_key(), access_token, ttl_seconds)
+        return access_token
+
+    # Fetch an access token and send it with every call made through the session
+    def authenticate(self):
+        self.access_token = self.get_access_token()
+        self.session.set_credentials(self.org_id, self.sandbox, self.api_key, self.access_token)
+        return self.access_token
+
+    # Fetch a new access token for the session once the current one is close to expiring, so a long running watch never
+    # sends an expired token
+    def refresh_token_before_expiry(self):
+        with self.session.refresh_lock:
+            if time.time() < self.access_token_expires_at:
+                return
+            print("Access token is about to expire. Fetching a new one...")
+            self.refresh_access_token()
+
+    # Drop the current access token (including any cached copy) and fetch a fresh one for the session
+    def refresh_access_token(self):
+        if self.cache is not None:
+            self.cache.invalidate(self.token_cache_key())
+        return self.authenticate()
+
+    # The standard schema class ID and the tenant ID embedded in it, authenticating and looking them up the first time
+    def lookup_schema_class(self):
+        with self.lock:
+            if self.access_token is None:
+                self.authenticate()
+            if self.schema_class_id is None:
+                self.schema_class_id, self.tenant_id = self.resolve_schema_class(STANDARD_SCHEMA_CLASS_NAME)
+            return self.schema_class_id, self.tenant_id
+
+    # Fetch AEP schema class list searching for whatever is specified as the standard schema class name
+    def fetch_schema_class(self, standard_schema_class_name):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/vnd.adobe.xed-id+json"
+        }
+        
+        response = self.session.get(
+            f"{self.platform_api_url}/data/foundation/schemaregistry/tenant/classes?limit=1&property=title=={standard_schema_class_name}",
+            headers=headers
+        )
+
+        try:
+            json_response = json.loads(response.text)
+            results = json_response.get("results", [])
             
-            print(f"Created dataset ID: {dataset_id}")
-            return dataset_id  # Return the dataset_id
-        else:
-            print(f"Failed to create dataset. Status code: {response.status_code}, Details: {json_response}")
-            return None  # Return None to indicate failure
-    except json.JSONDecodeError:
-        print(f"Failed to decode JSON. Raw response: {response.text}")
-        return None  # Return None to indicate an error
+            if results: # if this schema class already exists (the array is not empty)
+                schema_class_id = results[0].get("$id", None)
+                print(f"Existing schema class found: {schema_class_id}")
+                return schema_class_id  # Return the schema ID
+            else:  # If results array is empty
+                print("No existing lookup schema class found. Proceeding to create one...")
+                return None  # Return None to indicate that no results were found
+
+        except json.JSONDecodeError:
+            return f"Failed to decode JSON. Raw response: {response.text}"
+
+    # Find (or create) the standard schema class and return its ID along with the tenant ID embedded in it, reusing cached values
+    def resolve_schema_class(self, standard_schema_class_name):
+        cache_key = self.schema_class_cache_key(standard_schema_class_name)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached:
+                print(f"Using cached schema class: {cached['schema_class_id']}")
+                return cached["schema_class_id"], cached["tenant_id"]
+
+        schema_class_id = self.fetch_schema_class(standard_schema_class_name)
+        if not schema_class_id:
+            schema_class_id = self.create_schema_class(standard_schema_class_name)
+        if not schema_class_id:
+            return None, None
+
+        # Extract the tenant ID for use later
+        schema_class_id_parts = schema_class_id.split("/")
+        tenant_id = "_" + schema_class_id_parts[schema_class_id_parts.index("ns.adobe.com") + 1]
+
+        if self.cache is not None:
+            self.cache.set(cache_key, {"schema_class_id": schema_class_id, "tenant_id": tenant_id}, SCHEMA_CLASS_CACHE_TTL_SECONDS)
+        return schema_class_id, tenant_id
+
+    # Create Generic CJA Schema Class (used if it doesn't already exist)
+    def create_schema_class(self, standard_schema_class_name):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/vnd.adobe.xed-id+json"
+        }
+        
+        payload = {
+            "title": standard_schema_class_name,
+            "description": "A generic lookup class for creating schemas for lookup datasets for CJA.",
+            "imsOrg": self.org_id,
+            "type": "object",
+            "allOf": [
+                {
+                    "$ref": "https://ns.adobe.com/xdm/data/record",
+                }
+            ]
+        }
 
+        response = self.session.post(
+            f"{self.platform_api_url}/data/foundation/schemaregistry/tenant/classes",
+            headers = headers,
+            json = payload
+        )
+
+        try:
+            json_response = json.loads(response.text)
+            if response.status_code == 201:
+                schema_class_id = json_response.get('$id', None)
+                print(f"Created schema class ID: {schema_class_id}")
+                return schema_class_id  # Return the schema class ID
+            else:
+                print(f"Failed to create schema class. Status code: {response.status_code}, Details: {json_response}")
+                return None  # Return None to indicate failure
+        except json.JSONDecodeError:
+            print(f"Failed to decode JSON. Raw response: {response.text}")
+            return None  # Return None to indicate an error
+
+    # Create a field group to create a schema
+    def create_field_group(self, schema_class_id, tenant_id, csv_headers, lookup_dataset_name, column_types=None):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/vnd.adobe.xed-id+json"
+        }
 
+        payload = build_field_group_payload(schema_class_id, tenant_id, csv_headers, lookup_dataset_name, column_types)
 
-# Create a batch in the dataset we created earlier
-def create_batch(dataset_id):
-    headers = {
-        "Content-Type": "application/json",
-        "x-gw-ims-org-id": org_id,
-        "x-sandbox-name": sandbox,
-        "Authorization": f"Bearer {access_token}",
-        "x-api-key": api_key
-    }
+        response = self.session.post(
+            f"{self.platform_api_url}/data/foundation/schemaregistry/tenant/fieldgroups",
+            headers = headers,
+            json = payload
+        )
+        
+        try:
+            json_response = json.loads(response.text)
+            if response.status_code == 201:
+                field_group_id = json_response.get('$id', None)
+                print(f"Created field group ID: {field_group_id}")
+                return field_group_id  # Return the field_group_id
+            else:
+                print(f"Failed to create field group. Status code: {response.status_code}, Details: {json_response}")
+                return None  # Return None to indicate failure
+        except json.JSONDecodeError:
+            print(f"Failed to decode JSON. Raw response: {response.text}")
+            return None  # Return None to indicate an error
+
+    # Create a schema using the generic schema class and field group created above
+    def create_schema(self, schema_class_id, field_group_id, lookup_dataset_name):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/vnd.adobe.xed-id+json"
+        }
 
-    payload = {
-        "datasetId": dataset_id,
-        "inputFormat": {
-            "format": "json"
+        payload = build_schema_payload(schema_class_id, field_group_id, lookup_dataset_name)
+
+        response = self.session.post(
+            f"{self.platform_api_url}/data/foundation/schemaregistry/tenant/schemas",
+            headers = headers,
+            json = payload
+        )
+        
+        try:
+            json_response = json.loads(response.text)
+            if response.status_code == 201:
+                schema_id = json_response.get('$id', None)
+                print(f"Created schema ID: {schema_id}")
+                return schema_id  # Return the schema_id
+            else:
+                print(f"Failed to create schema. Status code: {response.status_code}, Details: {json_response}")
+                return None  # Return None to indicate failure
+        except json.JSONDecodeError:
+            print(f"Failed to decode JSON. Raw response: {response.text}")
+            return None  # Return None to indicate an error
+
+    # Create a dataset using the schema created above
+    def create_dataset(self, schema_id, lookup_dataset_name):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/vnd.adobe.xed-id+json"
+        }
+        
+        payload = {
+            "name": lookup_dataset_name,
+            "description": "A dataset created programatically for CJA.",
+            "schemaRef": {
+                "id": schema_id,
+                "contentType": "application/vnd.adobe.xed+json;version=1"
+            }
         }
-    }
 
-    response = requests.post(
-        "https://platform.adobe.io/data/foundation/import/batches",
-        headers = headers,
-        json = payload
-    )
-    
-    try:
-        json_response = json.loads(response.text)
-        if response.status_code == 201:
-            batch_id = json_response.get('id', None)
-            print(f"Created batch ID: {batch_id}")
-            return batch_id  # Return the batch_id
+        response = self.session.post(
+            f"{self.platform_api_url}/data/foundation/catalog/dataSets?requestDataSource=true",
+            headers = headers,
+            json = payload
+        )
+        
+        try:
+            json_response = json.loads(response.text)
+            if response.status_code == 201:
+                # Assuming the response is a list and we want the first item
+                dataset_path = json_response[0] if json_response else None
+                
+                # Extract the alphanumeric code after "dataSets/"
+                dataset_id = dataset_path.split("/dataSets/")[-1] if dataset_path else None
+                
+                print(f"Created dataset ID: {dataset_id}")
+                return dataset_id  # Return the dataset_id
+            else:
+                print(f"Failed to create dataset. Status code: {response.status_code}, Details: {json_response}")
+                return None  # Return None to indicate failure
+        except json.JSONDecodeError:
+            print(f"Failed to decode JSON. Raw response: {response.text}")
+            return None  # Return None to indicate an error
+
+    # Fetch a field group or schema ("fieldgroups" or "schemas") from the schema registry by title, returning its full definition
+    def fetch_registry_resource(self, resource_type, title):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/vnd.adobe.xed+json"
+        }
+
+        response = self.session.get(
+            f"{self.platform_api_url}/data/foundation/schemaregistry/tenant/{resource_type}",
+            headers = headers,
+            params = {"property": f"title=={title}"}
+        )
+
+        try:
+            results = json.loads(response.text).get("results", [])
+            return results[0] if results else None
+        except (json.JSONDecodeError, AttributeError):
+            print(f"Failed to look up {resource_type} titled {title}. Raw response: {response.text}")
+            return None
+
+    # Replace a field group or schema definition in the schema registry, returning its ID
+    def update_registry_resource(self, resource_type, resource_id, payload):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/vnd.adobe.xed-id+json"
+        }
+
+        response = self.session.put(
+            f"{self.platform_api_url}/data/foundation/schemaregistry/tenant/{resource_type}/{quote(resource_id, safe='')}",
+            headers = headers,
+            json = payload
+        )
+
+        if response.status_code == 200:
+            print(f"Updated {resource_type} ID: {resource_id}")
+            return resource_id
         else:
-            print(f"Failed to create dataset batch. Status code: {response.status_code}, Details: {json_response}")
+            print(f"Failed to update {resource_type} {resource_id}. Status code: {response.status_code}, Details: {response.text}")
             return None  # Return None to indicate failure
-    except json.JSONDecodeError:
-        print(f"Failed to decode JSON. Raw response: {response.text}")
-        return None  # Return None to indicate an error
-
-# Upload json file to the new batch
-def add_json_to_batch(batch_id, dataset_id, json_file_path):
-    headers = {
-        "content-type": "application/octet-stream",
-        "x-gw-ims-org-id": org_id,
-        "x-sandbox-name": sandbox,
-        "Authorization": f"Bearer {access_token}",
-        "x-api-key": api_key
-    }
 
-    with open(json_file_path, "rb") as f:
-        data_binary = f.read()
+    # Find an existing dataset with this name built on this schema, returning its ID
+    def fetch_dataset(self, schema_id, lookup_dataset_name):
+        response = self.session.get(
+            f"{self.platform_api_url}/data/foundation/catalog/dataSets",
+            params = {"name": lookup_dataset_name, "properties": "name,schemaRef"}
+        )
+
+        try:
+            json_response = json.loads(response.text)
+        except json.JSONDecodeError:
+            print(f"Failed to look up dataset {lookup_dataset_name}. Raw response: {response.text}")
+            return None
+
+        if response.status_code != 200 or not isinstance(json_response, dict):
+            return None
+        for dataset_id, dataset in json_response.items():
+            if dataset.get("name") == lookup_dataset_name and dataset.get("schemaRef", {}).get("id") == schema_id:
+                return dataset_id
+        return None
 
-    print("Uploading json to dataset...")
+    # Reuse the lookup's field group if it already exists with the same fields, update it if the headers changed, or create it
+    def ensure_field_group(self, schema_class_id, tenant_id, csv_headers, lookup_dataset_name, column_types=None):
+        payload = build_field_group_payload(schema_class_id, tenant_id, csv_headers, lookup_dataset_name, column_types)
+        existing = self.fetch_registry_resource("fieldgroups", payload["title"])
+        if existing is None:
+            return self.create_field_group(schema_class_id, tenant_id, csv_headers, lookup_dataset_name, column_types)
+
+        field_group_id = existing.get("$id")
+        if field_group_fields(existing, tenant_id, lookup_dataset_name) == field_group_fields(payload, tenant_id, lookup_dataset_name):
+            print(f"Reusing existing field group ID: {field_group_id} (headers unchanged)")
+            return field_group_id
+
+        print(f"Headers or column types changed since field group {field_group_id} was created. Updating it...")
+        return self.update_registry_resource("fieldgroups", field_group_id, payload)
+
+    # Reuse the lookup's schema if it already exists built on the same class and field group, or create it
+    def ensure_schema(self, schema_class_id, field_group_id, lookup_dataset_name):
+        payload = build_schema_payload(schema_class_id, field_group_id, lookup_dataset_name)
+        existing = self.fetch_registry_resource("schemas", payload["title"])
+        if existing is None:
+            return self.create_schema(schema_class_id, field_group_id, lookup_dataset_name)
+
+        schema_id = existing.get("$id")
+        existing_refs = {part.get("$ref") for part in existing.get("allOf", [])}
+        if {schema_class_id, field_group_id} <= existing_refs:
+            print(f"Reusing existing schema ID: {schema_id}")
+            return schema_id
+
+        print(f"Schema {schema_id} doesn't use this lookup's field group. Updating it...")
+        return self.update_registry_resource("schemas", schema_id, payload)
+
+    # Reuse the lookup's dataset if one with the same name is already built on its schema, or create it
+    def ensure_dataset(self, schema_id, lookup_dataset_name):
+        dataset_id = self.fetch_dataset(schema_id, lookup_dataset_name)
+        if dataset_id:
+            print(f"Reusing existing dataset ID: {dataset_id}")
+            return dataset_id
+        return self.create_dataset(schema_id, lookup_dataset_name)
+
+    # Create a batch in the dataset we created earlier, for files in input_format ("json" or "parquet")
+    def create_batch(self, dataset_id, input_format="json"):
+        headers = {
+            "Content-Type": "application/json"
+        }
 
-    response = requests.put(
-        f"https://platform.adobe.io/data/foundation/import/batches/{batch_id}/datasets/{dataset_id}/files/lookup_json_data.json",
-        headers = headers,
-        data = data_binary
-    )
-    
-    if response.status_code == 200:
-        print(f"Successfully loaded json to batch {batch_id}.")
-        return None
-    else:
-        print(f"Failed to upload json to batch. Status code: {response.status_code}")
-        return None  # Return None to indicate failure
+        payload = {
+            "datasetId": dataset_id,
+            "inputFormat": {
+                "format": input_format
+            }
+        }
 
-# Close the batch when we've written to it
-def close_batch(batch_id):
+        response = self.session.post(
+            f"{self.platform_api_url}/data/foundation/import/batches",
+            headers = headers,
+            json = payload
+        )
+        
+        try:
+            json_response = json.loads(response.text)
+            if response.status_code == 201:
+                batch_id = json_response.get('id', None)
+                print(f"Created batch ID: {batch_id}")
+                return batch_id  # Return the batch_id
+            else:
+                print(f"Failed to create dataset batch. Status code: {response.status_code}, Details: {json_response}")
+                return None  # Return None to indicate failure
+        except json.JSONDecodeError:
+            print(f"Failed to decode JSON. Raw response: {response.text}")
+            return None  # Return None to indicate an error
+
+    # Upload a single json (or parquet) part to the batch, where part_data is either an open file (streamed from disk) or bytes,
+    # already compressed with the named compression if one is given
+    def upload_json_part(self, batch_id, dataset_id, part_number, part_data, compression=None, output_format="json"):
+        headers = {
+            "content-type": "application/octet-stream"
+        }
 
-    headers = {
-        "x-gw-ims-org-id": org_id,
-        "x-sandbox-name": sandbox,
-        "Authorization": f"Bearer {access_token}",
-        "x-api-key": api_key
-    }
+        file_name = f"lookup_{output_format}_data_{part_number:05d}.{output_format}{COMPRESSION_EXTENSIONS.get(compression, '')}"
+        response = self.session.put(
+            f"{self.platform_api_url}/data/foundation/import/batches/{batch_id}/datasets/{dataset_id}/files/{file_name}",
+            headers = headers,
+            data = part_data
+        )
 
-    response = requests.post(
-        f"https://platform.adobe.io/data/foundation/import/batches/{batch_id}?action=COMPLETE",
-        headers=headers
-    )
-    
-    if response.status_code == 200:
-        print(f"Successfully closed batch {batch_id}.")
-        return None
-    else:
-        print(f"Failed to close batch. Status code: {response.status_code}")
-        return None  # Return None to indicate failure
+        if response.status_code == 200:
+            return True
+        else:
+            print(f"Failed to upload part {part_number + 1}. Status code: {response.status_code}")
+            return False
+
+    # Upload json part files to the new batch concurrently using a bounded pool of upload workers
+    # The bytes uploaded are added to counts["bytes"].
+    def add_json_to_batch(self, batch_id, dataset_id, json_file_paths, upload_workers=DEFAULT_UPLOAD_WORKERS, compression=None, compression_level=None, output_format="json", journal=None, counts=None):
+        counts = {} if counts is None else counts
+        part_count = len(json_file_paths)
+        print(f"Uploading json to dataset in {part_count} part(s) using {upload_workers} upload worker(s)...")
+
+        # Time each part from when a worker picks it up, not from when it was queued
+        def timed_upload(part_number, json_file_path):
+            checksum = part_checksum(json_file_path) if journal is not None else None
+            if checksum is not None and journal.uploaded_checksum(part_number) == checksum:
+                print(f"Part {part_number + 1} was already uploaded before resuming. Skipping...")
+                return True, 0.0, os.path.getsize(json_file_path)
+
+            part_start = time.time()
+            with open(json_file_path, "rb") as f:
+                if compression:
+                    upload_data = compress_part(f, compression, compression_level)
+                    uploaded_bytes = len(upload_data)
+                else:
+                    upload_data = f
+                    uploaded_bytes = os.path.getsize(json_file_path)
+                uploaded = self.upload_json_part(batch_id, dataset_id, part_number, upload_data, compression, output_format)
+            if uploaded and checksum is not None:
+                journal.record_upload(part_number, checksum)
+            return uploaded, time.time() - part_start, uploaded_bytes
+
+        failed_parts = []
+        completed_parts = 0
+        upload_start = time.time()
+        with ThreadPoolExecutor(max_workers=upload_workers) as executor:
+            futures = {}
+            for part_number, json_file_path in enumerate(json_file_paths):
+                future = executor.submit(timed_upload, part_number, json_file_path)
+                futures[future] = (part_number, json_file_path)
+
+            for future in as_completed(futures):
+                part_number, json_file_path = futures[future]
+                try:
+                    uploaded, part_seconds, uploaded_bytes = future.result()
+                except requests.RequestException as e:
+                    print(f"Failed to upload part {part_number + 1}: {e}")
+                    uploaded = False
+
+                if uploaded:
+                    completed_parts += 1
+                    counts["bytes"] = counts.get("bytes", 0) + uploaded_bytes
+                    part_size = describe_part_size(os.path.getsize(json_file_path), uploaded_bytes)
+                    print(f"Uploaded part {part_number + 1} ({part_size} in {part_seconds:.1f}s). {completed_parts} of {part_count} parts done.")
+                else:
+                    failed_parts.append(json_file_path)
+        
+        if not failed_parts:
+            print(f"Successfully loaded json to batch {batch_id} in {time.time() - upload_start:.1f}s.")
+            return True
+        else:
+            print(f"Failed to upload {len(failed_parts)} json part(s) to batch.")
+            return None  # Return None to indicate failure
 
-# Main function
-def main(args):
-    
-    # Grab command line arguments
-    file_path = args.file_path
-    lookup_dataset_name = args.dataset_name
-    creds_path = args.creds_file
-
-    # Set global credential variables for functions to use
-    global api_key
-    global client_secret
-    global org_id
-    global technical_account_id
-    global sandbox
-    global private_key
-    global access_token
-    
+    # Close the batch when we've written to it
+    def close_batch(self, batch_id):
+        response = self.session.post(
+            f"{self.platform_api_url}/data/foundation/import/batches/{batch_id}?action=COMPLETE"
+        )
+        
+        if response.status_code == 200:
+            print(f"Successfully closed batch {batch_id}.")
+            return True
+        else:
+            print(f"Failed to close batch. Status code: {response.status_code}")
+            return None  # Return None to indicate failure
+
+    # Fetch a batch's catalog entry (status, metrics and errors), or None if it couldn't be fetched
+    def fetch_batch_status(self, batch_id):
+        try:
+            response = self.session.get(f"{self.platform_api_url}/data/foundation/catalog/batches/{batch_id}")
+        except requests.RequestException as e:
+            print(f"Failed to fetch the status of batch {batch_id}: {e}")
+            return None
+
+        if response.status_code != 200:
+            print(f"Failed to fetch the status of batch {batch_id}. Status code: {response.status_code}")
+            return None
+        try:
+            return response.json().get(batch_id)
+        except json.JSONDecodeError:
+            print(f"Failed to decode JSON. Raw response: {response.text}")
+            return None
+
+    # Create the field group, schema and dataset for one lookup file, then convert and upload it into a new batch.
+    # With refresh_dataset_id the existing dataset is reused and only rows that changed since its last load are uploaded.
+    # Returns True if the lookup was loaded. The closed batch is handed to monitor, if given, to watch its ingestion.
+    # Each stage of the load is timed in metrics, if given. options holds the command line settings (see lookup_options).
+    # Part files and the quarantine file are written to work_folder, if given, instead of next to the file.
+    def load_lookup(self, file_path, lookup_dataset_name, options=None, refresh_dataset_id=None, monitor=None, metrics=None, work_folder=None):
+        options = lookup_options() if options is None else options
+        metrics = RunMetrics(self.session) if metrics is None else metrics
+        part_size = options.part_size_mb*1024*1024
+        upload_workers = options.upload_workers
+        pipeline = options.pipeline
+        workers = options.workers
+        compression = None if options.compression == "none" else options.compression
+        compression_level = options.compression_level
+        output_format = options.output_format
+        engine = options.engine
+
+        # Parquet compresses inside the file, so --compression picks its codec instead of compressing the uploaded part
+        parquet_compression = compression or "snappy"
+        if output_format == "parquet":
+            compression = None
+
+        # Authenticate and look up the schema class the first time this client loads a lookup
+        schema_class_id, tenant_id = self.lookup_schema_class()
+        if not schema_class_id:
+            print("Unable to find or create the lookup schema class. Skipping...")
+            return False
+
+        # Check if the file is a SAINT file or a CSV file, and find its headers and where its data rows start
+        with metrics.stage("inspect", lookup_dataset_name):
+            try:
+                layout = inspect_file(file_path)
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                print(f"Unable to read {file_path}: {e}. Skipping...")
+                return False
+        file_type = layout.file_type
+
+        if file_type == "saint":
+            print(f"SAINT classification file detected: {file_path}")
+        elif file_type == "csv":
+            print(f"csv file detected: {file_path}")
+        else:
+            print(f"Unrecognized file format detected (not csv or SAINT): {file_path}. Skipping...")
+            return False
+
+        if layout.headers is None:
+            print(f"No header row found in {file_path}. Skipping...")
+            return False
+        if layout.version:
+            print(f"Detected {layout.version} SAINT file.")
+
+        # The headers are sanitized to be acceptable as AEP schema fields
+        csv_headers = layout.headers
+        print(f"Read {file_type} file. Headers are: {csv_headers}")
+
+        # Journal each finished step so a failed load can be resumed with --resume. Its settings include everything that
+        # changes the uploaded parts, where they split included (each shard starts a part, and --pipeline never reuses them)
+        file_stat = source_stat(file_path)
+        run_identity = {
+            "file_path": file_path if file_path == STDIN_PATH else os.path.abspath(file_path),
+            "file_size": file_stat and file_stat.st_size,
+            "file_mtime_ns": file_stat and file_stat.st_mtime_ns,
+            "refresh_dataset_id": refresh_dataset_id,
+            "settings": [options.part_size_mb, options.workers, options.pipeline, output_format, options.compression, compression_level, engine, options.dedupe, options.infer_types, options.type_sample_rows, options.validate_types, options.validate_rows, options.max_field_length],
+        }
+        journal = CheckpointJournal(default_checkpoint_path(self.org_id, self.sandbox, lookup_dataset_name, file_path), run_identity)
+        if options.resume and journal.resume():
+            print(f"Resuming from checkpoint {journal.journal_path}.")
+        else:
+            earlier_journal = journal.read()
+            if options.resume:
+                print("No checkpoint found for this file and these settings. Starting from the beginning.")
+            elif earlier_journal is not None:
+                print(f"Discarding the checkpoint of an earlier unfinished load of {lookup_dataset_name} (use --resume to pick up where it stopped).")
+            # Part files kept by the earlier run would otherwise be left behind
+            for json_file_path, _ in (earlier_journal or {}).get("steps", {}).get("part_files", []):
+                if os.path.exists(json_file_path):
+                    os.remove(json_file_path)
+            journal.discard()
+
+        if journal.get("batch_closed"):
+            print(f"Batch {journal.get('batch_id')} was already loaded and closed before resuming.")
+            remove_part_files([json_file_path for json_file_path, _ in journal.get("part_files", [])])
+            journal.discard()
+            return True
+
+        # Infer column types from a sample of rows (or every row when validating) instead of treating everything as a string
+        column_types = journal.get("column_types")
+        if column_types is None and (options.infer_types or options.validate_types):
+            with metrics.stage("type_inference", lookup_dataset_name) as counts:
+                column_types = infer_lookup_column_types(file_path, layout, options, counts)
+            journal.record("column_types", column_types)
+        if column_types is not None:
+            print(f"Column types: {column_types}")
+
+        if refresh_dataset_id:
+            # Refreshing an existing dataset, so its field group, schema and dataset already exist
+            dataset_id = refresh_dataset_id
+            print(f"Refreshing dataset ID: {dataset_id}")
+        elif journal.get("dataset_id"):
+            dataset_id = journal.get("dataset_id")
+            print(f"Reusing dataset ID from checkpoint: {dataset_id}")
+        else:
+            # Create field group (or reuse it if the headers haven't changed)
+            with metrics.stage("field_group", lookup_dataset_name):
+                field_group_id = self.ensure_field_group(schema_class_id, tenant_id, csv_headers, lookup_dataset_name, column_types)
+                if not field_group_id and self.cache is not None and self.cache.get(self.schema_class_cache_key(STANDARD_SCHEMA_CLASS_NAME)):
+                    # The cached schema class may have been deleted since it was cached, so look it up again and retry once
+                    print("Retrying with a freshly looked up schema class...")
+                    self.cache.invalidate(self.schema_class_cache_key(STANDARD_SCHEMA_CLASS_NAME))
+                    self.schema_class_id = None
+                    schema_class_id, tenant_id = self.lookup_schema_class()
+                    if schema_class_id:
+                        field_group_id = self.ensure_field_group(schema_class_id, tenant_id, csv_headers, lookup_dataset_name, column_types)
+            if not field_group_id:
+                return False
+
+            # Create schema (or reuse it)
+            with metrics.stage("schema", lookup_dataset_name):
+                schema_id = self.ensure_schema(schema_class_id, field_group_id, lookup_dataset_name)
+            if not schema_id:
+                return False
+
+            # Create dataset (or reuse it)
+            with metrics.stage("dataset", lookup_dataset_name):
+                dataset_id = self.ensure_dataset(schema_id, lookup_dataset_name)
+            if not dataset_id:
+                return False
+            journal.record("dataset_id", dataset_id)
+
+        # Fingerprint rows when refreshing (or when asked to on a full load) so the next refresh only uploads what changed
+        fingerprint_index = None
+        row_filter = None
+        if refresh_dataset_id or options.track_changes:
+            fingerprint_index = FingerprintIndex(options.fingerprint_file or default_fingerprint_path(self.org_id, self.sandbox, dataset_id))
+            row_filter = fingerprint_index.filter_changed_rows
+
+        # Drop rows whose key appears elsewhere in the file, before they're fingerprinted
+        duplicate_key_index = None
+        if options.dedupe != "none":
+            if engine == "arrow":
+                print("The first or last row of each key is picked in file order, so rows are read with the python engine.")
+                engine = "python"
+            duplicate_key_index = DuplicateKeyIndex(options.dedupe, options.dedupe_memory_keys)
+            row_filter = compose_row_filters(duplicate_key_index.filter_duplicate_rows, row_filter)
+
+        # Check every row as it's converted, quarantining the ones that fail, so a bad file is caught before it's ingested
+        validator = None
+        if options.validate_rows:
+            if engine == "arrow":
+                print("Rows are validated from their raw cells, so they're read with the python engine.")
+            validator = RowValidator(layout, options.quarantine_file or default_quarantine_path(file_path, work_folder), options.max_field_length, options.max_rejected_rows, column_types)
+
+        try:
+            if duplicate_key_index is not None and duplicate_key_index.policy == "last":
+                print("Scanning for the last row of each key...")
+                with metrics.stage("dedupe_scan", lookup_dataset_name) as counts:
+                    duplicate_key_index.scan(count_rows(read_lookup_rows(file_path, layout, options, engine, column_types), counts))
+
+            if pipeline and fingerprint_index is None:
+                if workers > 1:
+                    print("--workers is ignored with --pipeline; the pipeline converts in a single process while uploading.")
+
+                # Open a dataset batch first so converted parts can be uploaded as soon as they fill
+                with metrics.stage("open_batch", lookup_dataset_name):
+                    batch_id = open_journaled_batch(self, journal, dataset_id, output_format)
+                if not batch_id:
+                    return False
+
+                # Convert the file and upload parts from memory as they fill
+                with metrics.stage("convert_and_upload", lookup_dataset_name) as counts:
+                    uploaded = csv_to_batch(self, file_path, tenant_id, lookup_dataset_name, layout, batch_id, dataset_id, part_size, upload_workers, row_filter, compression, compression_level, output_format, parquet_compression, column_types, engine, journal, counts, validator)
+                if validator is not None:
+                    validator.report()
+                    if validator.stopped:
+                        print(f"Stopped loading {file_path}: more than {options.max_rejected_rows} row(s) failed validation. Batch {batch_id} was left open, so nothing will be ingested.")
+                        return False
+                if duplicate_key_index is not None:
+                    print(f"Dropped {duplicate_key_index.dropped_rows} row(s) with duplicate keys ({options.dedupe} row kept).")
+
+                # Close the batch when done
+                with metrics.stage("close", lookup_dataset_name):
+                    loaded = close_journaled_batch(self, journal, batch_id, uploaded)
+                if loaded:
+                    journal.discard()
+                    if monitor is not None:
+                        monitor.add(batch_id, lookup_dataset_name)
+                return loaded
+
+            if pipeline:
+                print("--pipeline is ignored when fingerprinting rows; changed rows are staged to disk so an empty refresh doesn't open a batch.")
+
+            # Reuse the part files converted before resuming, unless rows are fingerprinted (the fingerprints staged by the
+            # earlier run are gone, and converting again gives the same parts since the index is only updated after a load)
+            part_files = journal.get("part_files")
+            if part_files and fingerprint_index is None and all(os.path.exists(path) and os.path.getsize(path) == size for path, size in part_files):
+                print(f"Reusing {len(part_files)} part file(s) converted before resuming.")
+                json_file_paths = [path for path, _ in part_files]
+            else:
+                # Read the CSV file and convert to JSON part files in same folder location
+                with metrics.stage("conversion", lookup_dataset_name) as counts:
+                    json_file_paths = csv_to_json(file_path, tenant_id, lookup_dataset_name, layout, part_size, workers, row_filter, output_format, parquet_compression, column_types, engine, counts, validator, work_folder)
+                if validator is not None:
+                    validator.report()
+                    if validator.stopped:
+                        print(f"Stopped loading {file_path}: more than {options.max_rejected_rows} row(s) failed validation. Nothing was uploaded.")
+                if json_file_paths is None:
+                    return False
+                journal.record("part_files", [(path, os.path.getsize(path)) for path in json_file_paths])
+
+                if duplicate_key_index is not None:
+                    print(f"Dropped {duplicate_key_index.dropped_rows} row(s) with duplicate keys ({options.dedupe} row kept).")
+                if fingerprint_index is not None:
+                    print(f"Rows inserted: {fingerprint_index.inserted_rows}, changed: {fingerprint_index.changed_rows}, unchanged: {fingerprint_index.unchanged_rows}")
+                    if not json_file_paths:
+                        print("No rows changed since the last load. Nothing to upload.")
+                        journal.discard()
+                        return True
+
+            # Open a dataset batch
+            with metrics.stage("open_batch", lookup_dataset_name):
+                batch_id = open_journaled_batch(self, journal, dataset_id, output_format)
+            uploaded = False
+            if batch_id:
+                # Add json part files to batch
+                with metrics.stage("upload", lookup_dataset_name) as counts:
+                    uploaded = self.add_json_to_batch(batch_id, dataset_id, json_file_paths, upload_workers, compression, compression_level, output_format, journal, counts)
+
+                # Close the batch when done
+                with metrics.stage("close", lookup_dataset_name):
+                    uploaded = close_journaled_batch(self, journal, batch_id, uploaded)
+
+            if uploaded:
+                # Delete the json part files that were created
+                remove_part_files(json_file_paths)
+                journal.discard()
+                if monitor is not None:
+                    monitor.add(batch_id, lookup_dataset_name)
+            elif batch_id:
+                print(f"Kept {len(json_file_paths)} part file(s) so --resume can upload the rest.")
+
+            # Only remember these rows once they've made it into the dataset
+            if uploaded and fingerprint_index is not None:
+                fingerprint_index.commit()
+                print(f"Updated fingerprint index {fingerprint_index.index_path}.")
+
+            return bool(uploaded)
+
+        finally:
+            if fingerprint_index is not None:
+                fingerprint_index.close()
+            if duplicate_key_index is not None:
+                duplicate_key_index.close()
+            if validator is not None:
+                validator.close()
+
+
+# Watch closed batches until AEP finishes ingesting them. Every batch is polled on its own schedule from one loop, starting
+# every BATCH_POLL_MIN_SECONDS and backing off by BATCH_POLL_BACKOFF_FACTOR up to BATCH_POLL_MAX_SECONDS while its status
+# doesn't change, so many batches can be watched at once without flooding the catalog API. Statuses are fetched through
+# client, the LookupClient that loaded the batches.
+class BatchMonitor:
+    def __init__(self, client, timeout_seconds=DEFAULT_MONITOR_TIMEOUT_SECONDS):
+        self.client = client
+        self.timeout_seconds = timeout_seconds
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.results = {}
+
+    # Start watching a batch that was just closed
+    def add(self, batch_id, label):
+        now = time.time()
+        with self.lock:
+            self.pending[batch_id] = {"label": label, "closed_at": now, "status": None, "interval": BATCH_POLL_MIN_SECONDS, "next_poll": now + BATCH_POLL_MIN_SECONDS}
+
+    # Poll every batch added so far until each one succeeds, fails or times out. Returns whether they all succeeded.
+    def wait(self):
+        if not self.pending:
+            return all(self.results.values())
+        print(f"Waiting for {len(self.pending)} batch(es) to be ingested...")
+
+        while True:
+            with self.lock:
+                if not self.pending:
+                    break
+                batch_id, entry = min(self.pending.items(), key=lambda item: item[1]["next_poll"])
+            time.sleep(max(0, entry["next_poll"] - time.time()))
+
+            batch = self.client.fetch_batch_status(batch_id)
+            status = (batch or {}).get("status")
+            elapsed = time.time() - entry["closed_at"]
+
+            if status in BATCH_SUCCESS_STATUSES:
+                self.report_success(batch_id, entry, batch, elapsed)
+                self.finish(batch_id, True)
+            elif status in BATCH_FAILURE_STATUSES:
+                errors = "; ".join(error.get("description", error.get("code", "")) for error in batch.get("errors", [])) or "no details"
+                print(f"Batch {batch_id} ({entry['label']}) failed ingestion with status {status} after {elapsed:.1f}s: {errors}")
+                self.finish(batch_id, False)
+            elif elapsed >= self.timeout_seconds:
+                print(f"Gave up waiting for batch {batch_id} ({entry['label']}) after {elapsed:.1f}s. Last status: {status}")
+                self.finish(batch_id, False)
+            else:
+                # Poll again soon after the status moves on, and less and less often while it stays the same
+                if status != entry["status"]:
+                    if status is not None:
+                        print(f"Batch {batch_id} ({entry['label']}) is {status} after {elapsed:.1f}s.")
+                    entry["interval"] = BATCH_POLL_MIN_SECONDS
+                else:
+                    entry["interval"] = min(entry["interval"]*BATCH_POLL_BACKOFF_FACTOR, BATCH_POLL_MAX_SECONDS)
+                entry["status"] = status
+                entry["next_poll"] = time.time() + entry["interval"]
+
+        succeeded = sum(self.results.values())
+        if len(self.results) > 1:
+            print(f"{succeeded} of {len(self.results)} batch(es) were ingested successfully.")
+        return succeeded == len(self.results)
+
+    def finish(self, batch_id, succeeded):
+        with self.lock:
+            self.pending.pop(batch_id, None)
+            self.results[batch_id] = succeeded
+
+    # Report how long ingestion took after the batch was closed and how fast rows and bytes went through
+    def report_success(self, batch_id, entry, batch, elapsed):
+        metrics = batch.get("metrics", {})
+        rows = metrics.get("outputRecordCount", metrics.get("inputRecordCount"))
+        input_bytes = metrics.get("inputByteSize")
+        throughput = []
+        if rows is not None:
+            throughput.append(f"{rows} rows, {rows / max(elapsed, 0.001):.0f} rows/s")
+        if input_bytes is not None:
+            throughput.append(f"{input_bytes / (1024*1024):.1f} MB, {input_bytes / (1024*1024) / max(elapsed, 0.001):.2f} MB/s")
+        failed_rows = metrics.get("failedRecordCount")
+        if failed_rows:
+            throughput.append(f"{failed_rows} rows failed")
+        details = f" ({', '.join(throughput)})" if throughput else ""
+        print(f"Batch {batch_id} ({entry['label']}) was ingested {elapsed:.1f}s after closing{details}.")
+
+# Read the credentials file supplied by the user into the keyword arguments LookupClient takes, reading the private key
+# from the file it points to
+def load_credentials(creds_path):
     # Open the credentials file supplied by user
     with open(creds_path, 'r') as f:
         config = json.load(f)
 
-    # Set global credentials variables from file
-    api_key = config['API_KEY']
-    client_secret = config['CLIENT_SECRET']
-    org_id = config['ORG_ID']
-    technical_account_id = config['TECHNICAL_ACCOUNT_ID']
-    sandbox = config['SANDBOX']
     with open(config['PRIVATE_KEY'], 'r') as f:
         private_key = f.read()
+    return {
+        "api_key": config['API_KEY'],
+        "client_secret": config['CLIENT_SECRET'],
+        "org_id": config['ORG_ID'],
+        "technical_account_id": config['TECHNICAL_ACCOUNT_ID'],
+        "sandbox": config['SANDBOX'],
+        "private_key": private_key,
+    }
 
-    # Fetch access token
-    access_token = get_access_token()
 
-    # Check if the file is a SAINT file or a CSV file
-    file_type = detect_file_type(file_path)
+# Read a manifest of lookup files to load. The manifest is either a directory or a zip archive, where every csv or SAINT
+# file in it (including the files inside any zip archive in the directory) is loaded into a dataset named after the file,
+# or a JSON/YAML file holding a list of {"file_path": ..., "dataset_name": ...} entries (or a {file_path: dataset_name}
+# mapping) with relative file paths resolved against the manifest's folder. Entries can also hold a "refresh_dataset_id"
+# to refresh an existing dataset instead of creating a new one. Relative paths are resolved against base_folder instead, if given.
+# Raises ValueError if two files would be loaded into datasets of the same name, since their loads would run at the same
+# time and overwrite each other.
+def read_manifest(manifest_path, base_folder=None):
+    if os.path.isdir(manifest_path) or source_compression(manifest_path) == "zip":
+        if os.path.isdir(manifest_path):
+            file_names = sorted(file_name for file_name in os.listdir(manifest_path) if not file_name.startswith("."))
+            file_paths = [os.path.join(manifest_path, file_name) for file_name in file_names if os.path.isfile(os.path.join(manifest_path, file_name))]
+        else:
+            file_paths = [manifest_path]
+
+        lookups = []
+        for file_path in (lookup_path for file_path in file_paths for lookup_path in expand_lookup_paths(file_path)):
+            try:
+                file_type = inspect_file(file_path).file_type
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                print(f"Skipping {file_path}: {e}")
+                continue
+            if file_type == "unknown":
+                print(f"Skipping {file_path}: not a csv or SAINT file.")
+                continue
+            lookups.append((file_path, os.path.splitext(lookup_file_name(file_path))[0], None))
+        return check_unique_dataset_names(manifest_path, lookups)
+
+    with open(manifest_path, 'r') as f:
+        if os.path.splitext(manifest_path)[1].lower() in (".yaml", ".yml"):
+            import yaml  # Only needed for YAML manifests
+            entries = yaml.safe_load(f)
+        else:
+            entries = json.load(f)
+
+    if isinstance(entries, dict):
+        entries = [{"file_path": file_path, "dataset_name": dataset_name} for file_path, dataset_name in entries.items()]
+
+    manifest_folder = base_folder or os.path.dirname(os.path.abspath(manifest_path))
+    lookups = [(os.path.join(manifest_folder, os.path.expanduser(entry["file_path"])), entry["dataset_name"], entry.get("refresh_dataset_id")) for entry in entries]
+    return check_unique_dataset_names(manifest_path, lookups)
+
+
+# Return the lookups of a manifest, raising ValueError if more than one of them is loaded into the same dataset
+def check_unique_dataset_names(manifest_path, lookups):
+    file_paths_by_dataset = {}
+    for file_path, lookup_dataset_name, _ in lookups:
+        file_paths_by_dataset.setdefault(lookup_dataset_name, []).append(file_path)
+    duplicates = {name: file_paths for name, file_paths in file_paths_by_dataset.items() if len(file_paths) > 1}
+    if duplicates:
+        details = "; ".join(f"{name}: {', '.join(file_paths)}" for name, file_paths in duplicates.items())
+        raise ValueError(f"{manifest_path} loads more than one file into the same dataset ({details}). Give each file its own dataset_name in a JSON or YAML manifest")
+    return lookups
+
+
+# Open a batch for the dataset, or reuse the one a resumed load already opened
+def open_journaled_batch(client, journal, dataset_id, output_format):
+    batch_id = journal.get("batch_id")
+    if batch_id:
+        print(f"Reusing batch ID from checkpoint: {batch_id}")
+        return batch_id
+
+    batch_id = client.create_batch(dataset_id, output_format)
+    if batch_id:
+        journal.record("batch_id", batch_id)
+    return batch_id
+
+
+# Close the batch once every part is uploaded. A batch with parts missing is left open so a --resume run can upload the
+# rest into it. Returns whether the batch was loaded and closed.
+def close_journaled_batch(client, journal, batch_id, uploaded):
+    if not uploaded:
+        print(f"Batch {batch_id} was left open so --resume can finish uploading it.")
+        return False
+
+    if not client.close_batch(batch_id):
+        return False
+    journal.record("batch_closed", True)
+    return True
+
+
+# Delete the temporary part files of a load
+def remove_part_files(json_file_paths):
+    for json_file_path in json_file_paths:
+        if os.path.exists(json_file_path):
+            os.remove(json_file_path)
+            print(f"The temporary file {json_file_path} has been deleted.")
+        else:
+            print(f"The temporary file {json_file_path} does not exist.")
 
-    if file_type == "saint":
-        print("SAINT classification file detected.")
-    elif file_type == "csv":
-        print("csv file detected.")
-    else:
-        print("Unrecognized file format detected (not csv or SAINT). Exiting...")
-        return
 
-    # Read CSV file headers
-    csv_headers = read_csv_headers(file_path, file_type)
+# Check every row of a lookup file without loading it, writing the rows that fail to the quarantine file. Returns True if
+# no row failed.
+def validate_lookup(file_path, options=None, metrics=None):
+    options = lookup_options() if options is None else options
+    metrics = RunMetrics() if metrics is None else metrics
+    try:
+        layout = inspect_file(file_path)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        print(f"Unable to read {file_path}: {e}")
+        return False
+    if layout.file_type == "unknown" or layout.headers is None:
+        print(f"{file_path} isn't a csv or SAINT file with a header row.")
+        return False
+    print(f"Validating {file_path}...")
+
+    column_types = None
+    if options.infer_types or options.validate_types:
+        with metrics.stage("type_inference", file_path) as counts:
+            column_types = infer_lookup_column_types(file_path, layout, options, counts)
+        print(f"Column types: {column_types}")
+
+    with metrics.stage("validation", file_path) as counts, RowValidator(layout, options.quarantine_file or default_quarantine_path(file_path), options.max_field_length, options.max_rejected_rows, column_types) as validator:
+        try:
+            for _ in count_rows(iter_rows(file_path, layout, validator=validator), counts):
+                pass
+        except RowValidationError as e:
+            print(f"Stopped validating {file_path}: {e}.")
+        validator.report()
+    return validator.rejected_rows == 0
+
+
+# Read the rows of a lookup file ahead of converting it (to infer types or find duplicate keys). With --validate_rows the
+# rows that will fail validation are skipped (without quarantining them), so these reads see the same rows conversion does.
+def read_lookup_rows(file_path, layout, options, engine="python", column_types=None):
+    if options.validate_rows or options.validate_only:
+        return iter_rows(file_path, layout, validator=RowValidator(layout, None, options.max_field_length, None, column_types))
+    return iter_file_rows(file_path, layout, engine)
+
+
+# Infer a lookup file's column types from a sample of its rows, or from every row with --validate_types
+def infer_lookup_column_types(file_path, layout, options, counts):
+    rows = read_lookup_rows(file_path, layout, options)
+    if options.validate_types:
+        print("Inferring column types from every row...")
+        return infer_column_types(count_rows(rows, counts), layout.headers)
+    return infer_column_types(count_rows(islice(rows, options.type_sample_rows), counts), layout.headers)
+
+
+# Path of the csv that rows failing validation are written to: next to the lookup file (or in work_folder), named after it
+def default_quarantine_path(file_path, work_folder=None):
+    return f"{part_file_base_path(file_path, work_folder)}_quarantine.csv"
+
+
+# Timing and throughput of each stage of a run (auth, schema class lookup, field group, schema, dataset, conversion,
+# upload, close and ingestion), written out as a JSON report or a Prometheus text file. Stages record their wall time,
+# the HTTP retries made while they ran (by any lookup loading at the time), the time spent waiting to retry, and the peak
+# memory of the run so far; stages that move data also record rows and bytes and their rates.
+class RunMetrics:
+    def __init__(self, session=None):
+        # PlatformSession whose retries and rate limit waits are counted, set once the run has opened one
+        self.session = session
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages = []
+
+    # Time the stage run inside the with block. The block can count what went through the stage in the "rows" and
+    # "bytes" of the dict it's given.
+    @contextmanager
+    def stage(self, name, lookup_dataset_name=None):
+        counts = {}
+        retries_before, retry_seconds_before = retry_totals(self.session)
+        rate_limit_seconds_before = rate_limit_wait_total(self.session)
+        stage_start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - stage_start
+            retries_after, retry_seconds_after = retry_totals(self.session)
+            rate_limit_seconds_after = rate_limit_wait_total(self.session)
+            record = {
+                "stage": name,
+                "lookup": lookup_dataset_name,
+                "seconds": round(seconds, 3),
+                "http_retries": retries_after - retries_before,
+                "retry_wait_seconds": round(retry_seconds_after - retry_seconds_before, 3),
+                "rate_limit_wait_seconds": round(rate_limit_seconds_after - rate_limit_seconds_before, 3),
+                "peak_rss_bytes": peak_rss_bytes(),
+            }
+            for count in ("rows", "bytes"):
+                if count in counts:
+                    record[count] = counts[count]
+                    record[f"{count}_per_second"] = round(counts[count] / seconds, 1) if seconds > 0 else None
+            with self.lock:
+                self.stages.append(record)
+
+    def report(self):
+        with self.lock:
+            stages = list(self.stages)
+        report = {
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "total_seconds": round(time.time() - self.started_at, 3),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "stages": stages,
+        }
+        # How often and how long calls waited for each client side rate limit over the whole run
+        if self.session is not None and self.session.rate_limits is not None:
+            report["rate_limits"] = self.session.rate_limits.totals()
+        return report
+
+    # Write the report as "json", or as "prometheus" text with stages of the same name and lookup added together
+    def write(self, metrics_path, metrics_format="json"):
+        report = self.report()
+        if metrics_format == "prometheus":
+            content = format_prometheus_metrics(report)
+        else:
+            content = json.dumps(report, indent=2) + "\n"
+
+        os.makedirs(os.path.dirname(metrics_path) or ".", exist_ok=True)
+        temp_path = f"{metrics_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(content)
+        os.replace(temp_path, metrics_path)
+        print(f"Wrote run metrics to {metrics_path}.")
+
+
+# Format a metrics report in the Prometheus text exposition format
+def format_prometheus_metrics(report):
+    totals = {}
+    for record in report["stages"]:
+        labels = (record["stage"], record["lookup"] or "")
+        total = totals.setdefault(labels, {})
+        for field in ("seconds", "http_retries", "retry_wait_seconds", "rate_limit_wait_seconds", "rows", "bytes"):
+            if field in record:
+                total[field] = total.get(field, 0) + record[field]
+
+    lines = []
+    for field, description in PROMETHEUS_STAGE_METRICS:
+        lines.append(f"# HELP lookup_creator_stage_{field} {description}")
+        lines.append(f"# TYPE lookup_creator_stage_{field} gauge")
+        for (stage, lookup_dataset_name), total in totals.items():
+            if field in total:
+                lines.append(f'lookup_creator_stage_{field}{{stage="{prometheus_label(stage)}",lookup="{prometheus_label(lookup_dataset_name)}"}} {total[field]}')
+
+    if report.get("rate_limits"):
+        for field, description in (("waits", "HTTP calls that waited for the client side rate limit"), ("wait_seconds", "Seconds HTTP calls spent waiting for the client side rate limit")):
+            lines.append(f"# HELP lookup_creator_rate_limit_{field} {description}")
+            lines.append(f"# TYPE lookup_creator_rate_limit_{field} gauge")
+            for limit, totals in report["rate_limits"].items():
+                lines.append(f'lookup_creator_rate_limit_{field}{{limit="{prometheus_label(limit)}"}} {totals[field]}')
+
+    lines.append("# HELP lookup_creator_run_seconds Wall time of the whole run")
+    lines.append("# TYPE lookup_creator_run_seconds gauge")
+    lines.append(f"lookup_creator_run_seconds {report['total_seconds']}")
+    if report["peak_rss_bytes"] is not None:
+        lines.append("# HELP lookup_creator_peak_rss_bytes Peak resident memory of the run and its worker processes")
+        lines.append("# TYPE lookup_creator_peak_rss_bytes gauge")
+        lines.append(f"lookup_creator_peak_rss_bytes {report['peak_rss_bytes']}")
+    return "\n".join(lines) + "\n"
+
+
+def prometheus_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Total HTTP retries made through session and seconds spent waiting to retry so far
+def retry_totals(session):
+    if session is None:
+        return 0, 0.0
+    return session.retry_count, session.retry_seconds
+
+
+# Total seconds calls made through session have waited for its client side rate limits so far
+def rate_limit_wait_total(session):
+    if session is None or session.rate_limits is None:
+        return 0.0
+    return session.rate_limits.wait_seconds()
+
+
+# Peak resident memory of this process or any of its worker processes, or None where it can't be measured (Windows)
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak if sys.platform == "darwin" else peak*1024  # Bytes on macOS, kilobytes elsewhere
+
+
+# Watch a drop folder and load every lookup file that lands in it, keeping the access token, pooled connections and schema
+# class warm between loads so a new file starts converting within about a second. A file is picked up once its size and
+# modification time are the same on two polls in a row (so files still being copied in are left alone) and is moved to
+# the processing subfolder while it loads, then to processed or failed. Each file is loaded into a dataset named after it.
+# A JSON or YAML file dropped in the folder is read as a manifest of jobs instead, loading the files it lists (relative
+# paths are resolved against the job_files subfolder) into the datasets it names. Part files and quarantine files are
+# written to the work subfolder, so only dropped files are ever in processing, and files left there by an earlier watch
+# that stopped partway are loaded again on start. A file's quarantine file is moved to processed or failed with it.
+# Files are loaded through client, a LookupClient. Runs until stop_event is set, then waits for the loads in progress to
+# finish.
+def watch_drop_folder(client, drop_folder, options, metrics, stop_event):
+    processing_folder, processed_folder, failed_folder, work_folder, job_files_folder = (os.path.join(drop_folder, name) for name in DROP_FOLDER_SUBFOLDERS)
+    for folder in (processing_folder, processed_folder, failed_folder, work_folder, job_files_folder):
+        os.makedirs(folder, exist_ok=True)
+
+    def load_drop_file(file_path):
+        quarantine_paths = []
+        try:
+            if os.path.splitext(file_path)[1].lower() in MANIFEST_EXTENSIONS:
+                lookups = read_manifest(file_path, job_files_folder)
+            else:
+                lookups = [(file_path, os.path.splitext(lookup_file_name(file_path))[0], None)]
+
+            loaded = True
+            for lookup_path, lookup_dataset_name, refresh_dataset_id in lookups:
+                monitor = BatchMonitor(client, options.monitor_timeout) if options.monitor else None
+                job_start = time.time()
+                quarantine_paths.append(default_quarantine_path(lookup_path, work_folder))
+                if client.load_lookup(lookup_path, lookup_dataset_name, options, refresh_dataset_id, monitor, metrics, work_folder) and (monitor is None or wait_for_ingestion(monitor, metrics)):
+                    print(f"Loaded {lookup_path} into dataset {lookup_dataset_name} in {time.time() - job_start:.1f}s.")
+                else:
+                    print(f"Failed to load {lookup_path} into dataset {lookup_dataset_name}.")
+                    loaded = False
+        except Exception as e:
+            print(f"An error occurred loading {file_path}: {e}")
+            loaded = False
+
+        archive_folder = processed_folder if loaded else failed_folder
+        archive_drop_file(file_path, archive_folder)
+        for quarantine_path in quarantine_paths:
+            if os.path.exists(quarantine_path):
+                archive_drop_file(quarantine_path, archive_folder)
+        if options.metrics_file:
+            metrics.write(options.metrics_file, options.metrics_format)
+
+    print(f"Watching {drop_folder} for lookup files. Press Ctrl+C to stop.")
+    last_seen = {}
+    loading = {}
+    with ThreadPoolExecutor(max_workers=options.max_concurrent_loads) as executor:
+        for file_name in sorted(os.listdir(processing_folder)):
+            print(f"Loading {file_name} again, since an earlier watch stopped while loading it...")
+            loading[file_name] = executor.submit(load_drop_file, os.path.join(processing_folder, file_name))
+
+        while not stop_event.is_set():
+            # Keep the access token fresh while idle too, so the next file doesn't wait for one
+            try:
+                client.refresh_token_before_expiry()
+            except (requests.RequestException, KeyError, ValueError) as e:
+                print(f"Failed to refresh the access token: {e}. Trying again on the next poll.")
+
+            loading = {file_name: future for file_name, future in loading.items() if not future.done()}
+            seen = {}
+            with os.scandir(drop_folder) as entries:
+                for entry in entries:
+                    if not entry.is_file() or entry.name.startswith((".", "~")) or entry.name.lower().endswith(DROP_FOLDER_PARTIAL_EXTENSIONS):
+                        continue
+                    stat = entry.stat()
+                    seen[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+            for file_name, signature in list(seen.items()):
+                # A file with the same name as one still loading (the next hourly drop, say) waits for it to finish
+                if last_seen.get(file_name) != signature or file_name in loading:
+                    continue
+                processing_path = os.path.join(processing_folder, file_name)
+                os.replace(os.path.join(drop_folder, file_name), processing_path)
+                print(f"Picked up {file_name}.")
+                loading[file_name] = executor.submit(load_drop_file, processing_path)
+                del seen[file_name]
+
+            last_seen = seen
+            stop_event.wait(options.watch_interval)
+
+        if loading:
+            print(f"Stopping. Waiting for {len(loading)} load(s) in progress to finish...")
+
+
+# Move a file out of the drop folder's processing (or work) subfolder into folder, adding the time to its name if a file of the same
+# name is already there
+def archive_drop_file(file_path, folder):
+    archive_path = os.path.join(folder, os.path.basename(file_path))
+    if os.path.exists(archive_path):
+        stem, ext = os.path.splitext(os.path.basename(file_path))
+        archive_path = os.path.join(folder, f"{stem}.{datetime.now().strftime('%Y%m%dT%H%M%S%f')}{ext}")
+    os.replace(file_path, archive_path)
+    print(f"Moved {os.path.basename(file_path)} to {archive_path}.")
+
+
+# Wait for the monitored batches to be ingested, timed as the "ingestion" stage
+def wait_for_ingestion(monitor, metrics):
+    with metrics.stage("ingestion"):
+        return monitor.wait()
+
 
-    # Sanitize the csv headers to be acceptable as AEP schema fields
-    csv_headers = sanitize_strings(csv_headers)
-    print(f"Read {file_type} file. Headers are: {csv_headers}")
+# Main function
+def main(args):
+    metrics = RunMetrics()
+    try:
+        return run(args, metrics)
+    finally:
+        if args.metrics_file:
+            metrics.write(args.metrics_file, args.metrics_format)
+
+
+# Load the lookup (or every lookup in the manifest), timing each stage in metrics. Returns the exit code.
+def run(args, metrics):
+    # Check optional packages up front rather than failing partway through an upload
+    if args.compression == "zstd" and args.output_format == "json":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            print("zstd compression needs the zstandard package (pip install zstandard). Exiting...")
+            return 1
+
+    if args.output_format == "parquet" or args.engine == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("Parquet output and the arrow engine need the pyarrow package (pip install pyarrow). Exiting...")
+            return 1
+
+    # Only check the rows of each file, without connecting to AEP
+    if args.validate_only:
+        try:
+            lookups = read_manifest(args.manifest) if args.manifest else [(args.file_path, args.dataset_name, None)]
+        except ValueError as e:
+            print(f"{e}. Exiting...")
+            return 1
+        validated = [validate_lookup(file_path, args, metrics) for file_path, _, _ in lookups]
+        return 0 if all(validated) else 1
+
+    # Open the cache of access tokens and schema class lookups from earlier runs
+    cache = None
+    if not args.no_cache:
+        cache = LookupCache(args.cache_file)
+        if args.clear_cache:
+            cache.clear()
+
+    # Pace every call of every concurrent load against the same budgets, when any are set
+    rate_limits = None
+    if args.schema_registry_rate or args.catalog_rate or args.ingestion_rate or args.upload_rate_mb:
+        rate_limits = PlatformRateLimits(args.schema_registry_rate, args.catalog_rate, args.ingestion_rate, args.upload_rate_mb and args.upload_rate_mb*1024*1024)
+
+    # Open a client with the credentials file, with enough pooled connections for every concurrent upload
+    concurrent_loads = args.max_concurrent_loads if args.manifest or args.watch else 1
+    client = LookupClient(**load_credentials(args.creds_file), platform_url=args.platform_url, ims_url=args.ims_url, cache=cache, timeout=(args.connect_timeout, args.read_timeout), max_retries=args.max_retries, pool_size=args.upload_workers*concurrent_loads, rate_limits=rate_limits)
+    metrics.session = client.session
+
+    # Fetch access token (a new one is fetched if it's rejected partway through the run)
+    with metrics.stage("auth"):
+        client.authenticate()
     
     # Check for existing schema class called "CJA Generic Lookup Class", if nonexistant, create one
-    standard_schema_class_name = "CJA Generic Lookup Class"
-    schema_class_id = fetch_schema_class(standard_schema_class_name)
+    with metrics.stage("schema_class"):
+        schema_class_id, _ = client.lookup_schema_class()
     if not schema_class_id:
-        schema_class_id = create_schema_class(standard_schema_class_name)
-
-    # Extract the tenant ID for use later
-    schema_class_id_parts = schema_class_id.split("/")
-    tenant_id = "_" + schema_class_id_parts[schema_class_id_parts.index("ns.adobe.com") + 1]
-
-    # Create field group
-    field_group_id = create_field_group(schema_class_id, tenant_id, csv_headers, lookup_dataset_name)
-
-    # Create schema
-    schema_id = create_schema(schema_class_id, field_group_id, lookup_dataset_name)
-
-    # Create dataset
-    dataset_id = create_dataset(schema_id, lookup_dataset_name)
-
-    # Read the CSV file and convert to a JSON file in same folder location
-    json_file_path = csv_to_json(file_path, tenant_id, lookup_dataset_name, file_type)
+        print("Unable to find or create the lookup schema class. Exiting...")
+        return 1
+
+    # Daemon mode: load files as they land in the drop folder until stopped, reusing this session, token and schema class
+    if args.watch:
+        stop_event = threading.Event()
+        for stop_signal in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(stop_signal, lambda signum, frame: stop_event.set())
+        watch_drop_folder(client, args.watch, args, metrics, stop_event)
+        return 0
+
+    # Watch closed batches until they're ingested when asked to
+    monitor = BatchMonitor(client, args.monitor_timeout) if args.monitor else None
+
+    if not args.manifest:
+        if not client.load_lookup(args.file_path, args.dataset_name, args, args.refresh_dataset_id, monitor, metrics):
+            return 1
+        return 0 if monitor is None or wait_for_ingestion(monitor, metrics) else 1
+
+    # Batch mode: load every lookup in the manifest, at most max_concurrent_loads at a time
+    try:
+        lookups = read_manifest(args.manifest)
+    except ValueError as e:
+        print(f"{e}. Exiting...")
+        return 1
+    print(f"Loading {len(lookups)} lookup file(s) with up to {concurrent_loads} at a time...")
+
+    failed_lookups = []
+    with ThreadPoolExecutor(max_workers=concurrent_loads) as executor:
+        futures = {
+            executor.submit(client.load_lookup, file_path, lookup_dataset_name, args, refresh_dataset_id, monitor, metrics): (file_path, lookup_dataset_name)
+            for file_path, lookup_dataset_name, refresh_dataset_id in lookups
+        }
+        for future in as_completed(futures):
+            file_path, lookup_dataset_name = futures[future]
+            try:
+                loaded = future.result()
+            except Exception as e:
+                print(f"An error occurred loading {file_path}: {e}")
+                loaded = False
+
+            if loaded:
+                print(f"Loaded {file_path} into dataset {lookup_dataset_name}.")
+            else:
+                print(f"Failed to load {file_path} into dataset {lookup_dataset_name}.")
+                failed_lookups.append(file_path)
 
-    # Open a dataset batch
-    batch_id = create_batch(dataset_id)
+    print(f"Loaded {len(lookups) - len(failed_lookups)} of {len(lookups)} lookup file(s).")
 
-    # Add json file to batch
-    add_json_to_batch(batch_id, dataset_id, json_file_path)
+    # Batches closed early in the run have been ingesting while the rest loaded, and are all watched together
+    ingested = monitor is None or wait_for_ingestion(monitor, metrics)
+    return 1 if failed_lookups or not ingested else 0
 
-    # Close the batch when done
-    close_batch(batch_id)
 
-    # Delete the json file that was created
-    if os.path.exists(json_file_path):
-        os.remove(json_file_path)
-        print(f"The temporary file {json_file_path} has been deleted.")
-    else:
-        print(f"The temporary file {json_file_path} does not exist.")
+# Command line arguments. Their defaults are also the defaults of the options load_lookup takes.
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='This script will accept a csv or SAINT classification file using the "file_path" argument and convert it into a dataset in AEP named by the "dataset_name" argment.')
+    parser.add_argument('--file_path', type=str, help='Path to the CSV or SAINT classification file, which can be gzip, bz2 or zip compressed (name a file in a zip holding several as archive.zip/file.tab), or - to read it from standard input')
+    parser.add_argument('--dataset_name', type=str, help='Name of the lookup dataset you want in AEP')
+    parser.add_argument('--manifest', type=str, help='Load many lookups in one run: a folder or zip archive of csv/SAINT files (each loaded into a dataset named after the file) or a JSON/YAML list of file_path/dataset_name entries')
+    parser.add_argument('--watch', type=str, help='Run until stopped, loading every csv/SAINT file (or JSON/YAML manifest of jobs) dropped into this folder into a dataset named after the file, keeping the access token, connections and schema class warm between loads')
+    parser.add_argument('--watch_interval', type=float, default=DEFAULT_WATCH_INTERVAL_SECONDS, help=f'Seconds between checks of the --watch folder for new files (default {DEFAULT_WATCH_INTERVAL_SECONDS})')
+    parser.add_argument('--max_concurrent_loads', type=int, default=DEFAULT_MAX_CONCURRENT_LOADS, help=f'Number of lookups from the manifest loaded at the same time (default {DEFAULT_MAX_CONCURRENT_LOADS})')
+    parser.add_argument('--creds_file', type=str, help='Path to the JSON file containing your API credentials (not needed with --validate_only)')
+    parser.add_argument('--refresh_dataset_id', type=str, help='Refresh this existing dataset (created from the same dataset_name) with only the rows that were inserted or changed since its last load')
+    parser.add_argument('--track_changes', action='store_true', help='Record row fingerprints on a full load so later --refresh_dataset_id runs only upload changed rows')
+    parser.add_argument('--fingerprint_file', type=str, help=f'Path to the row fingerprint index used by refreshes (default: one per dataset in {DEFAULT_FINGERPRINT_FOLDER})')
+    parser.add_argument('--dedupe', choices=["none", "first", "last"], default="none", help='Upload only one row per key (first column value), keeping the first or the last row for each key (default none)')
+    parser.add_argument('--dedupe_memory_keys', type=int, default=DEFAULT_DEDUPE_MEMORY_KEYS, help=f'Number of distinct keys --dedupe keeps in memory before moving its index to a temporary file on disk (default {DEFAULT_DEDUPE_MEMORY_KEYS})')
+    parser.add_argument('--resume', action='store_true', help=f'Pick up a failed load where it stopped, reusing its dataset, converted part files and open batch and only uploading the parts that are missing (checkpoints are kept in {DEFAULT_CHECKPOINT_FOLDER})')
+    parser.add_argument('--monitor', action='store_true', help='After closing each batch, wait until AEP has ingested it, report ingestion time and throughput, and exit with a nonzero status if ingestion fails')
+    parser.add_argument('--monitor_timeout', type=float, default=DEFAULT_MONITOR_TIMEOUT_SECONDS, help=f'Seconds to wait for a batch to be ingested before giving up (default {DEFAULT_MONITOR_TIMEOUT_SECONDS})')
+    parser.add_argument('--metrics_file', type=str, help='Write the time, rows/s, bytes/s, HTTP retries and peak memory of each stage of the run to this file')
+    parser.add_argument('--metrics_format', choices=["json", "prometheus"], default="json", help='Format of --metrics_file: a JSON report or Prometheus text exposition format (default json)')
+    parser.add_argument('--platform_url', type=str, default=DEFAULT_PLATFORM_API_URL, help=f'Base URL of the Platform API, e.g. a local stand-in server for benchmarking (default {DEFAULT_PLATFORM_API_URL})')
+    parser.add_argument('--ims_url', type=str, default=DEFAULT_IMS_URL, help=f'Base URL of the IMS service that issues access tokens (default {DEFAULT_IMS_URL})')
+    parser.add_argument('--validate_rows', action='store_true', help='Check every row as it is converted (cell count, encoding, empty key, cell length and, with inferred types, value types) and leave the rows that fail out of the load, writing them to a quarantine file')
+    parser.add_argument('--validate_only', action='store_true', help='Check every row like --validate_rows and write the quarantine file, without connecting to AEP or loading anything; exits with a nonzero status if any row fails')
+    parser.add_argument('--quarantine_file', type=str, help='Path of the csv that rows failing validation are written to (default: next to the file, named <file>_quarantine.csv)')
+    parser.add_argument('--max_field_length', type=int, default=DEFAULT_MAX_FIELD_LENGTH, help=f'Longest cell, in characters, that validation lets through (default {DEFAULT_MAX_FIELD_LENGTH})')
+    parser.add_argument('--max_rejected_rows', type=int, help='Stop the load (or the check) once more than this many rows have failed validation (default: no limit)')
+    parser.add_argument('--part_size_mb', type=int, default=DEFAULT_PART_SIZE_MB, help=f'Maximum size in MB of each json part file uploaded to the batch (default {DEFAULT_PART_SIZE_MB})')
+    parser.add_argument('--upload_workers', type=int, default=DEFAULT_UPLOAD_WORKERS, help=f'Number of json part files uploaded concurrently (default {DEFAULT_UPLOAD_WORKERS})')
+    parser.add_argument('--infer_types', action='store_true', help='Infer integer, number, boolean and date columns from a sample of rows instead of loading every column as a string')
+    parser.add_argument('--type_sample_rows', type=int, default=DEFAULT_TYPE_SAMPLE_ROWS, help=f'Number of rows sampled by --infer_types (default {DEFAULT_TYPE_SAMPLE_ROWS})')
+    parser.add_argument('--validate_types', action='store_true', help='Infer column types from every row, so no value can fail to match its type (slower, reads the file an extra time)')
+    parser.add_argument('--output_format', choices=["json", "parquet"], default="json", help='Format of the files uploaded to the batch; parquet is columnar and dictionary encoded and needs the pyarrow package (default json)')
+    parser.add_argument('--compression', choices=["none", "gzip", "zstd"], default="none", help='Compress each json part before uploading it, or the codec used inside parquet parts (default snappy for parquet; zstd needs the zstandard package for json)')
+    parser.add_argument('--compression_level', type=int, help='Compression level (default 6 for gzip, 3 for zstd)')
+    parser.add_argument('--max_retries', type=int, default=DEFAULT_MAX_RETRIES, help=f'Number of times a throttled or failed API call is retried with exponential backoff (default {DEFAULT_MAX_RETRIES})')
+    parser.add_argument('--schema_registry_rate', type=float, help='Most schema registry API calls (classes, field groups, schemas) made per second, shared by every lookup loading at the same time (default: no limit)')
+    parser.add_argument('--catalog_rate', type=float, help='Most catalog API calls (datasets, batch status) made per second, shared by every lookup loading at the same time (default: no limit)')
+    parser.add_argument('--ingestion_rate', type=float, help='Most batch ingestion API calls (creating, uploading to and closing batches) made per second, shared by every lookup loading at the same time (default: no limit)')
+    parser.add_argument('--upload_rate_mb', type=float, help='Most MB uploaded per second, shared by every upload worker of every lookup loading at the same time (default: no limit)')
+    parser.add_argument('--connect_timeout', type=float, default=DEFAULT_TIMEOUT[0], help=f'Seconds to wait for a connection to the API (default {DEFAULT_TIMEOUT[0]})')
+    parser.add_argument('--read_timeout', type=float, default=DEFAULT_TIMEOUT[1], help=f'Seconds to wait for an API response (default {DEFAULT_TIMEOUT[1]})')
+    parser.add_argument('--cache_file', type=str, default=DEFAULT_CACHE_PATH, help=f'Path to the cache of access tokens and schema class lookups reused between runs (default {DEFAULT_CACHE_PATH})')
+    parser.add_argument('--no_cache', action='store_true', help='Always fetch a new access token and look up the schema class instead of using the cache')
+    parser.add_argument('--clear_cache', action='store_true', help='Empty the cache before running')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to convert the file, each converting its own byte range (default 1)')
+    parser.add_argument('--engine', choices=["python", "arrow"], default="python", help='Parse the file row by row with the csv module, or in blocks of columns with pyarrow, which is several times faster on large files (default python)')
+    parser.add_argument('--pipeline', action='store_true', help='Upload json parts from memory while the file is still converting instead of writing temporary json files first')
+    return parser
+
+
+# Options for LookupClient.load_lookup and validate_lookup when they're called from other code instead of the command line:
+# the command line defaults, with those given as keyword arguments (named like the command line arguments) replaced
+def lookup_options(**overrides):
+    options = build_arg_parser().parse_args([])
+    for name, value in overrides.items():
+        if not hasattr(options, name):
+            raise TypeError(f"Unknown lookup option: {name}")
+        setattr(options, name, value)
+    return options
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='This script will accept a csv or SAINT classification file using the "file_path" argument and convert it into a dataset in AEP named by the "dataset_name" argment.')
-    parser.add_argument('--file_path', type=str, help='Path to the CSV or SAINT classification file', required=True)
-    parser.add_argument('--dataset_name', type=str, help='Name of the lookup dataset you want in AEP', required=True)
-    parser.add_argument('--creds_file', type=str, help='Path to the JSON file containing your API credentials', required=True)
-    
+    parser = build_arg_parser()
     args = parser.parse_args()
-    main(args)
+    if sum(bool(source) for source in (args.file_path, args.manifest, args.watch)) > 1:
+        parser.error("only one of --file_path, --manifest and --watch can be used")
+    if not args.manifest and not args.watch and not (args.file_path and (args.dataset_name or args.validate_only)):
+        parser.error("either --manifest, --watch or both --file_path and --dataset_name are required")
+    if args.watch and (args.fingerprint_file or args.quarantine_file or args.validate_only):
+        parser.error("--fingerprint_file, --quarantine_file and --validate_only can't be used with --watch")
+    if not args.creds_file and not args.validate_only:
+        parser.error("--creds_file is required")
+    if args.manifest and args.quarantine_file:
+        parser.error("--quarantine_file can't be used with --manifest since each file gets its own quarantine file")
+    if args.manifest and args.fingerprint_file:
+        parser.error("--fingerprint_file can't be used with --manifest since each dataset keeps its own fingerprint index")
+    if any(rate is not None and rate <= 0 for rate in (args.schema_registry_rate, args.catalog_rate, args.ingestion_rate, args.upload_rate_mb)):
+        parser.error("--schema_registry_rate, --catalog_rate, --ingestion_rate and --upload_rate_mb must be greater than 0")
+    if args.file_path == STDIN_PATH and (args.infer_types or args.validate_types or args.dedupe == "last" or args.resume):
+        parser.error("--infer_types, --validate_types, --dedupe last and --resume read the file more than once, so they can't be used when reading from standard input")
+    sys.exit(main(args))